@@ -0,0 +1,2 @@
+# Benchmarks for measuring the performance of the sorter
+__author__ = "Matteo Golin"
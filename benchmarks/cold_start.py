@@ -0,0 +1,135 @@
+# Budget check of the cold start of the quick subcommands, which scripts may run hundreds of times a day
+__author__ = "Matteo Golin"
+
+# Imports
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from classes.application import Application
+from classes.config import Config
+from classes.control import ControlServer
+
+# Constants
+REPEATS = 5
+IMPORT_BUDGET = 0.06  # Seconds the imports of a quick subcommand may take
+RUN_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, "run.py"))
+
+# Modules that the quick subcommands must never import, as they belong to the sorter
+FORBIDDEN_MODULES = ["watchdog", "classes.handler", "classes.application", "classes.directory", "sqlite3"]
+
+# Modules that add-directory must not import when it registers the directory itself, as it moves no files
+LOCAL_FORBIDDEN_MODULES = ["watchdog", "classes.handler", "sqlite3", "multiprocessing", "concurrent.futures"]
+
+# Quick subcommands, run from a directory with a config file while a sorter is answering requests
+COMMANDS = {
+    "add-directory": ["add-directory", "archive", "report", "invoice"],
+    "mod-config": ["mod-config", "-workers", "2"],
+}
+
+# Quick subcommands run while no sorter is running, which load and save the configurations themselves
+LOCAL_COMMANDS = {
+    "config": (["config", "watch", "!"], FORBIDDEN_MODULES),
+    "add-directory": (["add-directory", "archive", "report", "invoice"], LOCAL_FORBIDDEN_MODULES),
+    "mod-config": (["mod-config", "-workers", "2"], FORBIDDEN_MODULES),
+}
+
+
+# Functions
+def measure(command: list[str]) -> tuple[float, float, set[str]]:
+
+    """Runs the command in a new interpreter, returning its duration, the time its imports took and their names."""
+
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", RUN_FILE, *command], capture_output=True, text=True, check=True
+    )
+    duration = time.perf_counter() - start
+
+    import_time = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():  # The header line
+            continue
+
+        modules.add(name.strip())
+        if not name.startswith("  "):  # Top level imports include the time of the imports below them
+            import_time += int(cumulative)
+
+    return duration, import_time / 1_000_000, modules
+
+
+def forbidden(modules: set[str], forbidden_modules: list[str] = FORBIDDEN_MODULES) -> list[str]:
+
+    """Returns the forbidden modules, or their submodules, that were imported."""
+
+    return sorted(
+        module for module in modules
+        if any(module == name or module.startswith(f"{name}.") for name in forbidden_modules)
+    )
+
+
+def check(command: list[str], repeats: int, forbidden_modules: list[str]) -> dict:
+
+    """Measures a command after a warm up run, returning its median durations and the forbidden modules imported."""
+
+    measure(command)  # Warm up the file system cache and the bytecode cache
+    runs = [measure(command) for _ in range(repeats)]
+
+    return {
+        "median_seconds": statistics.median(run[0] for run in runs),
+        "median_import_seconds": statistics.median(run[1] for run in runs),
+        "forbidden_imports": forbidden(runs[-1][2], forbidden_modules),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fails if the quick subcommands start slower than the budget allows.")
+    parser.add_argument("-budget", type=float, default=IMPORT_BUDGET, help="Seconds of imports allowed per command.")
+    parser.add_argument("-repeats", type=int, default=REPEATS)
+    arguments = parser.parse_args()
+
+    results = {"budget_seconds": arguments.budget}
+    failed = False
+
+    with tempfile.TemporaryDirectory() as root:
+        os.chdir(root)
+        os.mkdir("watch")
+        os.mkdir("archive")
+        Config(watch_dir="watch", ignored_names=[], ignore_char="!").save({})
+
+        for name, (command, forbidden_modules) in LOCAL_COMMANDS.items():
+            label = name if name == "config" else f"{name} without a sorter"  # config is refused while one runs
+            results[label] = check(command, arguments.repeats, forbidden_modules)
+
+        server = ControlServer(Application().requests())
+        server.start()
+
+        try:
+            for name, command in COMMANDS.items():
+                results[name] = check(command, arguments.repeats, FORBIDDEN_MODULES)
+        finally:
+            server.stop()
+
+        for result in results.values():
+            if isinstance(result, dict):
+                over_budget = result["median_import_seconds"] > arguments.budget
+                failed = failed or over_budget or bool(result["forbidden_imports"])
+
+    results["passed"] = not failed
+    print(json.dumps(results, indent=2))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
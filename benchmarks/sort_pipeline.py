@@ -0,0 +1,271 @@
+# Benchmark of the sort pipeline over synthetic directory trees and watched folders
+__author__ = "Matteo Golin"
+
+# Imports
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from classes.application import Application
+from classes.config import Config
+from classes.directory import Directory
+from utils.logging import move_log
+
+# Constants
+DIRECTORIES = 2000
+TAGS_PER_DIRECTORY = 3
+TAG_OVERLAP = 0.5
+FILES = 2000
+SEED = 0
+SCENARIOS = ["single", "initial-sort", "plan"]
+
+NAME_TEMPLATES = [
+    "{tag}_{year}-{month:02d}_{number}.pdf",
+    "IMG_{number:04d}.jpg",
+    "{tag} {tag2} notes.docx",
+    "{tag}-report-{year}.xlsx",
+    "Screenshot {year}-{month:02d}-{day:02d} {number}.png",
+    "{tag}_{tag2}_v{day}.zip",
+    "download ({day}).pdf",
+]
+
+
+# Functions
+def make_vocabulary(directories: int, tags_per_directory: int, overlap: float, rng: random.Random) -> list[str]:
+
+    """
+    Returns the tags the directories are drawn from. An overlap of 0 gives every tag assignment its own tag, while
+    an overlap close to 1 makes all directories share the same few tags.
+    """
+
+    size = max(1, round(directories * tags_per_directory * (1 - overlap)))
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    vocabulary = set()
+
+    while len(vocabulary) < size:
+        vocabulary.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 8))))
+
+    return sorted(vocabulary)
+
+
+def make_tree(root: str, directories: int, tags_per_directory: int, vocabulary: list[str], rng: random.Random):
+
+    """Creates a tree of directories under root and registers each of them with tags from the vocabulary."""
+
+    paths = [root]
+
+    for number in range(directories):
+        parent = rng.choice(paths[-50:])  # Nest new directories under recent ones to get some depth
+        path = os.path.join(parent, f"folder{number}")
+        os.mkdir(path)
+        paths.append(path)
+
+        Directory(path=path, tags=rng.sample(vocabulary, min(tags_per_directory, len(vocabulary))))
+
+
+def make_files(watched: str, files: int, vocabulary: list[str], rng: random.Random) -> list[str]:
+
+    """Creates files with realistic names and log-normally distributed sizes in the watched directory."""
+
+    paths = []
+
+    for number in range(files):
+        name = rng.choice(NAME_TEMPLATES).format(
+            tag=rng.choice(vocabulary),
+            tag2=rng.choice(vocabulary),
+            year=rng.randint(2015, 2026),
+            month=rng.randint(1, 12),
+            day=rng.randint(1, 28),
+            number=number,
+        )
+        path = os.path.join(watched, f"{number} {name}")  # The number keeps every name unique
+
+        with open(path, "wb") as file:
+            file.write(os.urandom(min(int(rng.lognormvariate(9, 1.5)), 4 * 1024 * 1024)))
+
+        paths.append(path)
+
+    return paths
+
+
+def percentiles(durations: list[float]) -> dict:
+
+    """Returns the median, 90th, 99th percentile and maximum of the durations, in milliseconds."""
+
+    if len(durations) < 2:
+        durations = durations * 2 or [0.0, 0.0]
+
+    cuts = statistics.quantiles(durations, n=100, method="inclusive")
+    return {
+        "p50_ms": cuts[49] * 1000,
+        "p90_ms": cuts[89] * 1000,
+        "p99_ms": cuts[98] * 1000,
+        "max_ms": max(durations) * 1000,
+    }
+
+
+def bench_single(app: Application, files: list[str]) -> dict:
+
+    """Sorts the files one at a time like the event handler does, timing the match and nest stages separately."""
+
+    match_durations = []
+    nest_durations = []
+    total_durations = []
+    moved = 0
+
+    for file_path in files:
+        start = time.perf_counter()
+        directory, score = app.route(file_path)
+        matched = time.perf_counter()
+
+        if directory is not None:
+            directory.nest_file(file_path, score)
+            moved += 1
+        nested = time.perf_counter()
+
+        match_durations.append(matched - start)
+        if directory is not None:
+            nest_durations.append(nested - matched)
+        total_durations.append(nested - start)
+
+    move_log.close()  # Include the time taken to write the remaining log records
+    elapsed = sum(total_durations)
+
+    return {
+        "files": len(files),
+        "moved": moved,
+        "files_per_second": len(files) / elapsed if elapsed else None,
+        "match": percentiles(match_durations),
+        "nest": percentiles(nest_durations),
+        "total": percentiles(total_durations),
+    }
+
+
+def bench_initial_sort(app: Application, watched: str, files: int, workers: int) -> dict:
+
+    """Sorts the whole watched directory at once like the initial-sort subcommand does."""
+
+    start = time.perf_counter()
+    moved = app.sort_directory(watched, workers=workers)
+    move_log.close()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "files": files,
+        "moved": moved,
+        "workers": workers,
+        "seconds": elapsed,
+        "files_per_second": files / elapsed if elapsed else None,
+    }
+
+
+def bench_plan(app: Application, watched: str, files: int, workers: int) -> dict:
+
+    """Plans the watched directory and then applies the plan, timing the scoring and moving phases separately."""
+
+    plan_path = os.path.join(os.path.dirname(watched), "plan.jsonl")
+
+    start = time.perf_counter()
+    app.plan(watched, plan_path)
+    planned = time.perf_counter()
+    moved = app.apply_plan(plan_path, workers=workers)
+    move_log.close()
+    applied = time.perf_counter()
+
+    return {
+        "files": files,
+        "moved": moved,
+        "workers": workers,
+        "plan_seconds": planned - start,
+        "apply_seconds": applied - planned,
+        "plan_files_per_second": files / (planned - start) if planned > start else None,
+        "apply_files_per_second": moved / (applied - planned) if applied > planned else None,
+    }
+
+
+def run_scenario(name: str, arguments: argparse.Namespace, root: str) -> dict:
+
+    """Builds a fresh tree and watched folder, then runs the named scenario, tracking its peak memory."""
+
+    Directory.reset()  # As if the scenario was started in a new process
+
+    rng = random.Random(arguments.seed)
+    scenario_root = os.path.join(root, name)
+    tree, watched = os.path.join(scenario_root, "tree"), os.path.join(scenario_root, "watched")
+    os.makedirs(tree)
+    os.makedirs(watched)
+
+    if arguments.memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    vocabulary = make_vocabulary(arguments.directories, arguments.tags, arguments.overlap, rng)
+    make_tree(tree, arguments.directories, arguments.tags, vocabulary, rng)
+    build_seconds = time.perf_counter() - start
+
+    files = make_files(watched, arguments.files, vocabulary, rng)
+    app = Application(Config(watch_dir=watched, ignored_names=[], ignore_char="!"))
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if name == "single":
+            result = bench_single(app, files)
+        elif name == "plan":
+            result = bench_plan(app, watched, len(files), arguments.workers)
+        else:
+            result = bench_initial_sort(app, watched, len(files), arguments.workers)
+
+    result["tree_build_seconds"] = build_seconds
+    if arguments.memory:
+        result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the sort pipeline on synthetic directory trees.")
+    parser.add_argument("-directories", type=int, default=DIRECTORIES, help="Number of tagged directories.")
+    parser.add_argument("-tags", type=int, default=TAGS_PER_DIRECTORY, help="Number of tags per directory.")
+    parser.add_argument("-overlap", type=float, default=TAG_OVERLAP, help="How much tags are shared, from 0 to 1.")
+    parser.add_argument("-files", type=int, default=FILES, help="Number of files in the watched directory.")
+    parser.add_argument("-workers", type=int, default=os.cpu_count() or 4, help="Workers used by initial-sort.")
+    parser.add_argument("-seed", type=int, default=SEED)
+    parser.add_argument("-scenarios", nargs="*", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("-no-memory", dest="memory", action="store_false", help="Skip tracing peak memory.")
+    parser.add_argument("-output", help="Writes the results to this file instead of printing them.")
+    arguments = parser.parse_args()
+
+    results = {
+        "parameters": vars(arguments),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "scenarios": {},
+    }
+
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        os.chdir(root)  # Keeps the move log out of the working directory
+        try:
+            for name in arguments.scenarios:
+                results["scenarios"][name] = run_scenario(name, arguments, root)
+        finally:
+            os.chdir(working_directory)
+
+    output = json.dumps(results, indent=2)
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Benchmark of loading the configurations at startup, with and without the binary snapshot cache
+__author__ = "Matteo Golin"
+
+# Imports
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from classes.application import Application
+from classes.config import Config
+from classes.directory import Directory
+
+# Constants
+DIRECTORIES = 100_000
+TAGS_PER_DIRECTORY = 3
+REPEATS = 5
+
+
+# Functions
+def write_config(directories: int, tags_per_directory: int):
+
+    """Writes a config file with the passed number of synthetic directories to the current directory."""
+
+    data = Config(watch_dir=os.getcwd(), ignored_names=[], ignore_char="!").settings()
+    data["directories"] = {
+        os.path.join("archive", f"group{number // 100}", f"folder{number}"): {
+            "tags": [f"tag{(number + offset) % 5000}" for offset in range(tags_per_directory)],
+        }
+        for number in range(directories)
+    }
+
+    with open(Config.filename, "w") as config:
+        json.dump(data, config)
+
+
+def time_load(repeats: int, cached: bool) -> list[float]:
+
+    """
+    Returns the duration of each config load. If cached is False, the cache is deleted before each load, so the
+    JSON is parsed and the cache rewritten every time.
+    """
+
+    cache = Config(watch_dir="", ignored_names=[], ignore_char="!").storage.cache
+    durations = []
+
+    for _ in range(repeats):
+        if not cached and os.path.exists(cache):
+            os.remove(cache)
+
+        # Start every load from an empty set of directories, like a new process would
+        Directory.reset()
+
+        start = time.perf_counter()
+        Application.load_config()
+        durations.append(time.perf_counter() - start)
+
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures config loading with and without the snapshot cache.")
+    parser.add_argument("-directories", type=int, default=DIRECTORIES)
+    parser.add_argument("-tags", type=int, default=TAGS_PER_DIRECTORY)
+    parser.add_argument("-repeats", type=int, default=REPEATS)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        os.chdir(root)
+        write_config(arguments.directories, arguments.tags)
+
+        results = {"directories": arguments.directories, "tags_per_directory": arguments.tags}
+        for name, cached in (("cache_miss", False), ("cache_hit", True)):
+            time_load(1, cached)  # Warm up the file system cache, and write the snapshot cache for the cached run
+            durations = time_load(arguments.repeats, cached)
+            results[name] = {"median_seconds": statistics.median(durations), "min_seconds": min(durations)}
+
+        results["speedup"] = results["cache_miss"]["median_seconds"] / results["cache_hit"]["median_seconds"]
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,33 @@
+from __future__ import annotations
+
 # Main application class
 __author__ = "Matteo Golin"
 
 # Imports
 from .config import Config
 from .directory import Directory
+from .tag_index import Ranking
 import utils as u
+import utils.metrics as metrics
+from utils.files import move_file
+from utils.journal import move_journal, new_batch, journal_file_movements
+from utils.walk import walk_directories
 import json
 import os
+import threading
+import time
+from functools import cached_property
+from typing import TYPE_CHECKING, Iterable, Iterator
+
+if TYPE_CHECKING:
+    from utils.classifier import Classifier
+    from utils.dedupe import DedupeIndex
+
+# Constants
+BATCH_SIZE = 500  # Files scored together during a directory sort, and the interval between progress reports
+SEARCH_RESULTS = 10  # Directories returned by a search
+CHECKPOINT_SUFFIX = ".checkpoint"  # Added to the name of an audit report for the file its progress is saved to
+CHECKPOINT_INTERVAL = 5.0  # Seconds between saves of the audit progress
 
 
 # Class
@@ -20,82 +41,771 @@ class Application:
         else:
             self.config = config
 
+        Directory.ignored_names = self.config.ignored_names
+        self.batch = new_batch()  # Files sorted one at a time by this run are undone together
+        self.lock = threading.RLock()  # Held while the configurations are changed or saved
+
+    # Properties
+    @cached_property
+    def classifier(self) -> Classifier:
+
+        """The classifier of file content, created the first time a file is classified."""
+
+        from utils.classifier import Classifier  # Imports sqlite3, which the command line subcommands never use
+
+        return Classifier()  # Only opens its cache once a file is classified
+
+    @cached_property
+    def dedupe(self) -> DedupeIndex:
+
+        """The index of file checksums, created the first time a file is checked for duplicates."""
+
+        from utils.dedupe import DedupeIndex
+
+        return DedupeIndex()  # Only opens its index once a file is checked for duplicates
+
     # Methods
     def create_sub_dirs(self, root: str):
 
         """
         Creates directory objects for all the subdirectories (and their subdirectories, etc.) of the passed
-        directory.
+        directory. Directories with ignored names are skipped along with everything below them, and directories that
+        already exist keep their tags.
         """
 
-        subdir_list = os.walk(root)
-
-        for path, dirs, files in subdir_list:
-            if os.path.isdir(path) and any(name in path for name in self.config.ignored_names):
+        for path in walk_directories(root, self.config.ignored_names):
+            if path not in Directory.directories:
                 Directory(
                     path=path,
                     tags=[],
                 )
 
+    def save(self):
+
+        """Saves the configurations, writing only what changed since the last save."""
+
+        with self.lock:
+            self.config.save(Directory.directories, Directory.pop_changes())
+
+    def add_directory(
+            self, path: str, tags: list[str], recursive: bool = False, parent_tags: bool = False
+    ) -> Directory:
+
+        """Registers a directory with the passed tags, or adds the tags to it if it is already registered."""
+
+        path = os.path.abspath(path)
+
+        with self.lock:
+            directory = Directory.directories.get(path)
+
+            if directory:
+                directory.add_tags(tags, recursive)
+                if parent_tags:
+                    directory.add_parent_tags(recursive)
+            else:
+                directory = Directory(
+                    path=path,
+                    tags=tags,
+                    recursive=recursive,
+                    parent_tags=parent_tags
+                )
+
+        return directory
+
+    def requests(self) -> dict:
+
+        """
+        Returns the commands a running sorter answers for command line invocations, by name. Each takes the parsed
+        command line arguments, applies them to the loaded configurations and saves them, and returns what to print.
+        """
+
+        def add_directory(arguments: dict) -> str:
+            recursive = arguments.get("recursive_tags")
+            directory = self.add_directory(
+                arguments.get("path"), arguments.get("tags"), recursive, arguments.get("parent_tags")
+            )
+            self.save()
+            return f"Director{'ies' if recursive else 'y'} successfully added.\n\n{directory}"
+
+        def mod_config(arguments: dict) -> str:
+            self.update_config(arguments)
+            self.save()
+            return f"Config successfully modified.\n\n{self.config}"
+
+        return {"add-directory": add_directory, "mod-config": mod_config}
+
     def clean_up(self):
 
         """Shuts down the application, saving the configurations."""
 
-        self.config.save(Directory.directories)
+        self.save()
 
-    def sort_file(self, file_path: str):
+        # Only the ones that were created
+        if "classifier" in vars(self):
+            self.classifier.close()
+        if "dedupe" in vars(self):
+            self.dedupe.close()
 
-        """Sorts the passed file into its proper place, ignoring files that contain ignored characters."""
+    def move_directory(self, old_path: str, new_path: str) -> list[Directory]:
 
-        if self.config.ignore_char not in file_path:
-            chosen_directory = self.get_best_dir(file_path)
+        """Updates the registered directories after a directory was moved or renamed on disk. Returns them."""
 
-            # If there are 0 matching tags, do not move the file
-            if not chosen_directory.matching_tags(file_path) == 0:
-                chosen_directory.nest_file(file_path)
+        with self.lock:
+            moved = Directory.move_tree(old_path, new_path)
+            if moved:
+                print(f"Updated directories moved from {old_path} to {new_path}.")
+                self.save()
 
-    def update_config(self, commandline_args: dict):
+        return moved
 
-        """Updates the config information with the commandline argument values."""
+    def remove_directory(self, path: str) -> list[Directory]:
+
+        """Unregisters the directories below a directory that was deleted on disk. Returns them."""
+
+        with self.lock:
+            removed = Directory.remove_tree(path)
+            if removed:
+                print(f"Removed deleted directory {path}.")
+                self.save()
+
+        return removed
+
+    def route(self, file_path: str) -> tuple[Directory | None, int]:
+
+        """
+        Returns the directory the passed file should be nested in and its number of matching tags. The directory is
+        None if the file contains the ignore character or has no matching tags.
+        """
+
+        if self.config.ignore_char in u.filename(file_path):
+            metrics.files_ignored.inc()
+            return None, 0
+
+        (directory, score), _ = self.rank(file_path)
+
+        if directory is None:
+            metrics.files_unmatched.inc()
+
+        return directory, score
+
+    def rank(self, file_path: str) -> Ranking:
+
+        """
+        Returns the best and runner-up directories for the passed file and their numbers of matching tags, using the
+        description of its content as well as its name if classification is turned on.
+        """
+
+        content = self.describe(file_path)
+
+        start = time.perf_counter()
+        ranking = Directory.index.rank(u.filename(file_path), content)
+        metrics.match_seconds.observe(time.perf_counter() - start)
+
+        return ranking
+
+    def describe(self, file_path: str) -> str:
+
+        """Returns the description of the file's content tags are matched against, if classification is turned on."""
+
+        if not self.config.classify:
+            return ""
+
+        start = time.perf_counter()
+        content = self.classifier.describe(file_path)
+        metrics.classify_seconds.observe(time.perf_counter() - start)
+        return content
+
+    def sort_file(self, file_path: str) -> str | None:
+
+        """
+        Sorts the passed file into its proper place, ignoring files that contain ignored characters. Returns the new
+        path of the file, or None if it was not moved.
+        """
+
+        chosen_directory, score = self.route(file_path)
+
+        # If there are 0 matching tags, do not move the file
+        if chosen_directory is None:
+            return None
+
+        return self.nest(chosen_directory, file_path, score, self.batch)
+
+    def nest(
+            self, directory: Directory, file_path: str, score: int, batch: str, reserved: str | None = None
+    ) -> str | None:
+
+        """
+        Nests the file in the directory, returning its new path. If duplicate detection is turned on and an identical
+        file is already in the directory, the file is skipped, linked to the identical file or deleted, depending on
+        the configured mode, and None is returned unless it was linked. A path reserved in the directory whose move
+        was already journaled can be passed on to the directory as reserved.
+        """
+
+        if self.config.dedupe == "off":
+            return directory.nest_file(file_path, score, self.config.verify_copies, batch, reserved=reserved)
+
+        duplicate, digests = self.dedupe.find(file_path, directory.path)
+
+        if duplicate is not None:
+            metrics.duplicates.inc()
+
+            if self.config.dedupe == "skip":
+                print(f"Skipped {file_path}, which is identical to {duplicate}.")
+                return None
+
+            if self.config.dedupe == "discard":
+                os.remove(file_path)
+                print(f"Deleted {file_path}, which is identical to {duplicate}.")
+                return None
+
+        new_path = directory.nest_file(
+            file_path, score, self.config.verify_copies, batch, link_to=duplicate, reserved=reserved
+        )
+        self.dedupe.add(new_path, directory.path, digests)
+        return new_path
+
+    def sort_directory(self, root: str, workers: int, batch_size: int = BATCH_SIZE, settle: float = 0) -> int:
+
+        """
+        Sorts every file directly inside the passed directory. Entries are streamed and scored in batches, while the
+        moves run on a pool of workers with at most one pending move per worker queued ahead. All moves are journaled
+        as one batch, so that the whole sort can be undone, with a single sync for the moves of each batch of files.
+        If settle is given, files that change within that many seconds are left alone. Returns the number of files
+        moved.
+        """
+
+        journal_batch = new_batch()
+        print(f"Sorting {root} as batch {journal_batch}.")
+
+        files = self.__scan_files(root)
+        if settle:
+            files = self.__settled_files(files, settle, batch_size)
+
+        # Each batch is scored as a whole before any of its moves are queued
+        routes = (
+            [(file_path, *self.route(file_path)) for file_path in batch]
+            for batch in u.batched(files, batch_size)
+        )
+        scanned, moved = self.__nest_all(routes, workers, journal_batch, "Initial sort")
+
+        print(f"Initial sort complete: {scanned} files scanned, {moved} moved. Undo with: undo -batch {journal_batch}")
+        return moved
+
+    def plan(self, root: str, plan_path: str, batch_size: int = BATCH_SIZE) -> int:
+
+        """
+        Scores every file directly inside the passed directory without moving anything, and writes one JSON line per
+        file to the plan file, with its source, target directory, score, runner-up directory and score, and whether
+        the target won a tie. Files with no matching tags have no target. Returns the number of files planned.
+        """
+
+        planned = 0
+        matched = 0
+        ties = 0
+
+        with open(plan_path, "w") as plan:
+            for batch in u.batched(self.__scan_files(root), batch_size):
+                lines = []
+
+                for file_path in batch:
+                    if self.config.ignore_char in u.filename(file_path):
+                        continue
+
+                    (target, score), (runner_up, runner_up_score) = self.rank(file_path)
+                    tie = target is not None and runner_up_score == score
+
+                    lines.append(json.dumps({
+                        "source": os.path.abspath(file_path),
+                        "target": target.path if target else None,
+                        "score": score,
+                        "runner_up": runner_up.path if runner_up else None,
+                        "runner_up_score": runner_up_score,
+                        "tie": tie,
+                    }))
+                    matched += target is not None
+                    ties += tie
+
+                plan.write("".join(f"{line}\n" for line in lines))
+                planned += len(lines)
+
+        print(f"Planned {planned} files: {matched} matched, {ties} of them by a tie, {planned - matched} unmatched.")
+        return planned
+
+    def apply_plan(self, plan_path: str, workers: int, batch_size: int = BATCH_SIZE) -> int:
+
+        """
+        Moves the files of a plan written by plan into their target directories on a pool of workers, without scoring
+        them again. Targets that are no longer registered are skipped. All moves are journaled as one batch, so that
+        the whole plan can be undone. Returns the number of files moved.
+        """
+
+        journal_batch = new_batch()
+        print(f"Applying {plan_path} as batch {journal_batch}.")
+
+        routes = (
+            [(entry["source"], self.__plan_target(entry), entry["score"]) for entry in batch]
+            for batch in u.batched(self.__read_plan(plan_path), batch_size)
+        )
+        read, moved = self.__nest_all(routes, workers, journal_batch, "Applying plan")
+
+        print(f"Plan applied: {read} files read, {moved} moved. Undo with: undo -batch {journal_batch}")
+        return moved
+
+    def __nest_all(
+            self,
+            routes: Iterable[list[tuple[str, Directory | None, int]]],
+            workers: int,
+            journal_batch: str,
+            label: str,
+    ) -> tuple[int, int]:
+
+        """
+        Nests batches of (file path, directory, score) routes on a pool of workers, with at most one pending move per
+        worker queued ahead, skipping routes without a directory. The moves of each batch are journaled together
+        before any of them is queued, and those that were not made are recorded as cancelled once they are done.
+        Prints the progress after every batch. Returns the number of routes read and files moved.
+        """
+
+        read = 0
+        moved = 0
+        pending = {}  # Future -> journaled (file path, new path) move
+        cancelled = []  # Journaled moves that were not made, recorded together after each batch
 
-        watch_dir = commandline_args.get("-watch-dir")
-        ignore_char = commandline_args.get("-ignore-char")
-        ignored_names = commandline_args.get("-ignored-names")
+        def collect(done):
+            nonlocal moved
+            for future in done:
+                move = pending.pop(future)
+                try:
+                    if future.result() is not None:
+                        moved += 1
+                        continue
+                except OSError as error:
+                    metrics.errors.inc()
+                    print(f"Could not sort file: {error}")
+                cancelled.append(move)
 
-        if watch_dir:
-            self.config.watch_dir = watch_dir
+        # Slow to import, so only imported when files are moved
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-        if ignore_char:
-            self.config.ignore_char = ignore_char
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nest") as executor:
+            for batch in routes:
+                for file_path, directory, score, new_path in self.__reserve(batch, journal_batch):
+                    if len(pending) >= workers * 2:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
 
-        if ignored_names:
-            self.config.ignored_names.extend(ignored_names)
+                    future = executor.submit(self.nest, directory, file_path, score, journal_batch, new_path)
+                    pending[future] = (file_path, new_path)
+
+                journal_file_movements(cancelled, journal_batch, cancelled=True)
+                cancelled.clear()
+
+                read += len(batch)
+                print(f"{label}: {read} files read, {moved} moved.")
+
+            collect(wait(pending).done)
+            journal_file_movements(cancelled, journal_batch, cancelled=True)
+
+        return read, moved
+
+    @staticmethod
+    def __reserve(
+            routes: list[tuple[str, Directory | None, int]], batch: str
+    ) -> list[tuple[str, Directory, int, str]]:
+
+        """
+        Reserves a path in its directory for every routed file, skipping routes without a directory or whose directory
+        cannot be read, and journals all of their moves under the batch with a single sync before any of them is made.
+        Returns the routes with their reserved paths.
+        """
+
+        reserved = []
+
+        for file_path, directory, score in routes:
+            if directory is None:
+                continue
+
+            try:
+                reserved.append((file_path, directory, score, directory.reserve_path(file_path)))
+            except OSError as error:  # The directory was removed or cannot be read
+                metrics.errors.inc()
+                print(f"Could not sort {file_path}: {error}")
+
+        journal_file_movements([(file_path, new_path) for file_path, _, _, new_path in reserved], batch)
+        return reserved
+
+    def audit_file(self, file_path: str, current_path: str) -> dict | None:
+
+        """
+        Scores a file already nested in the directory at the current path, and returns its audit report entry if
+        another directory now has more matching tags, or None if it is where it belongs. Files with the ignore
+        character are never misfiled.
+        """
+
+        if self.config.ignore_char in u.filename(file_path):
+            return None
+
+        content = self.describe(file_path)
+        (target, score), _ = Directory.index.rank(u.filename(file_path), content)
+        if target is None or target.path == current_path:
+            return None
+
+        current = Directory.directories.get(current_path)
+        current_score = current.matching_tags(f"{u.filename(file_path)}\n{content}") if current else 0
+        if score <= current_score:  # Ties leave the file where it is
+            return None
+
+        return {
+            "source": os.path.abspath(file_path),
+            "current": current_path,
+            "target": target.path,
+            "score": score,
+            "current_score": current_score,
+        }
+
+    def audit(
+            self,
+            report_path: str,
+            workers: int | None = None,
+            move: bool = False,
+            restart: bool = False,
+            batch_size: int = BATCH_SIZE,
+    ) -> int:
+
+        """
+        Scores every file directly inside every added directory again on a pool of processes, and writes a JSON line
+        to the report for each file that another directory now has more matching tags for. The files are moved there
+        if move is set, as one batch that can be undone. Directories are audited in order of their paths, and the last
+        directory whose results were written is saved next to the report every few seconds, so an interrupted audit
+        resumes after it unless restart is set. Files are streamed in batches with a bounded number of batches being
+        scored at once, so memory does not grow with the size of the archive. Returns the number of misfiled files.
+        """
+
+        workers = workers or os.cpu_count() or 1
+        checkpoint_path = f"{report_path}{CHECKPOINT_SUFFIX}"
+        checkpoint = None if restart else self.__read_checkpoint(checkpoint_path)
+
+        if checkpoint is None:
+            checkpoint = {"done": None, "size": 0, "batch": new_batch()}
+        else:
+            print(f"Resuming the audit after {checkpoint['done']}.")
+
+        done = checkpoint["done"]
+        paths = sorted(path for path in Directory.directories if done is None or path > done)
+        audited = 0
+        misfiled = 0
+        moved = 0
+
+        pending = {}  # Future -> index of the first directory with files in its batch
+        results = {}  # Directory index -> report entries, held until every file of the directory was scored
+        completed = -1  # Index of the last directory whose results were written
+        saved = time.monotonic()
+
+        def collect(done):
+            nonlocal audited
+            for future in done:
+                del pending[future]
+                count, entries = future.result()
+                audited += count
+                for index, entry in entries:
+                    results.setdefault(index, []).append(entry)
+
+        def advance(limit: int):
+            nonlocal completed, misfiled, moved, saved
+            if limit <= completed + 1:
+                return
+
+            entries = [entry for index in range(completed + 1, limit) for entry in results.pop(index, ())]
+            misfiled += len(entries)
+            if move:
+                moved += self.__move_misfiled(entries, checkpoint["batch"])
+            for entry in entries:
+                report.write(f"{json.dumps(entry)}\n")
+
+            completed = limit - 1
+            if time.monotonic() - saved >= CHECKPOINT_INTERVAL:
+                report.flush()
+                self.__write_checkpoint(
+                    checkpoint_path, {**checkpoint, "done": paths[completed], "size": report.tell()}
+                )
+                saved = time.monotonic()
+
+        import multiprocessing  # Slow to import, so only imported when an audit runs
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+        # Spawned workers load the configurations themselves rather than inheriting the sorter's threads and locks
+        context = multiprocessing.get_context("spawn")
+
+        with (
+            open(report_path, "a") as report,
+            ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=start_auditor) as executor,
+        ):
+            report.truncate(checkpoint["size"])  # Entries written after the last save are audited again
+            batch = []
+            first = None
+
+            for index, path in enumerate(paths):
+                try:
+                    for file_path in self.__scan_files(path):
+                        if first is None:
+                            first = index
+                        batch.append((file_path, path, index))
+
+                        if len(batch) >= batch_size:
+                            if len(pending) >= workers * 2:
+                                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                                collect(done)
+                                print(f"Audit: {audited} files audited, {misfiled} misfiled.")
+
+                            pending[executor.submit(audit_files, batch)] = first
+                            batch = []
+                            first = None
+
+                except OSError as error:  # Removed or unreadable since it was added
+                    print(f"Could not audit {path}: {error}")
+
+                advance(min([*pending.values(), index + 1 if first is None else first]))
+
+            if batch:
+                pending[executor.submit(audit_files, batch)] = first
+
+            collect(wait(pending).done)
+            advance(len(paths))
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        summary = f"Audit complete: {audited} files audited, {misfiled} misfiled"
+        if move:
+            summary += f", {moved} moved. Undo with: undo -batch {checkpoint['batch']}"
+        print(f"{summary}. Report: {report_path}")
+        return misfiled
+
+    def __move_misfiled(self, entries: list[dict], batch: str) -> int:
+
+        """
+        Nests misfiled files in the directories they now belong in, setting the new path of each report entry, or None
+        if it was not moved. The moves are journaled together before any of them is made. Returns the number moved.
+        """
+
+        by_source = {}
+        for entry in entries:
+            entry["moved_to"] = None
+            by_source[entry["source"]] = entry
+
+        routes = [(entry["source"], Directory.directories.get(entry["target"]), entry["score"]) for entry in entries]
+        moved = 0
+        cancelled = []
+
+        for file_path, directory, score, new_path in self.__reserve(routes, batch):
+            entry = by_source[file_path]
+            try:
+                entry["moved_to"] = self.nest(directory, file_path, score, batch, new_path)
+            except OSError as error:
+                metrics.errors.inc()
+                print(f"Could not move {file_path}: {error}")
+
+            if entry["moved_to"] is None:
+                cancelled.append((file_path, new_path))
+            else:
+                moved += 1
+
+        journal_file_movements(cancelled, batch, cancelled=True)
+        return moved
+
+    @staticmethod
+    def __read_checkpoint(checkpoint_path: str) -> dict | None:
+
+        """Returns the saved progress of an interrupted audit, or None if there is none."""
+
+        try:
+            with open(checkpoint_path) as checkpoint:
+                return json.load(checkpoint)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def __write_checkpoint(checkpoint_path: str, checkpoint: dict):
+
+        """Atomically replaces the saved progress of the audit."""
+
+        temporary = f"{checkpoint_path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(checkpoint, file)
+        os.replace(temporary, checkpoint_path)
+
+    @staticmethod
+    def __read_plan(plan_path: str) -> Iterator[dict]:
+
+        """Streams the entries of a plan file."""
+
+        with open(plan_path) as plan:
+            for line in plan:
+                if line.strip():
+                    yield json.loads(line)
+
+    @staticmethod
+    def __plan_target(entry: dict) -> Directory | None:
+
+        """Returns the registered directory a plan entry targets, or None if it has no target or is not registered."""
+
+        if entry["target"] is None:
+            return None
+
+        directory = Directory.directories.get(entry["target"])
+        if directory is None:
+            print(f"Skipped {entry['source']}, as {entry['target']} is no longer an added directory.")
+
+        return directory
+
+    def undo(self, batch: str | None = None, since: float | None = None, until: float | None = None) -> int:
+
+        """
+        Moves the files journaled in the passed batch and/or time range back to where they came from, newest first.
+        Files that are no longer where they were moved to, or whose original path was taken since, are left alone.
+        The moves back are journaled as a batch of their own. Returns the number of files moved back.
+        """
+
+        moves = []  # Journaled moves in the batch and time range, or None once cancelled
+        latest = {}  # (old path, new path) -> index of its latest journaled move, None if outside the time range
+
+        for record in move_journal.read():
+            if batch is not None and record.get("batch") != batch:
+                continue
+
+            move = (record["old_path"], record["new_path"])
+
+            # Cancellations are written after the moves they cancel, so they are matched whenever they were written
+            if record.get("cancelled"):
+                index = latest.pop(move, None)
+                if index is not None:
+                    moves[index] = None
+                continue
+
+            timestamp = record["timestamp"]
+            if (since is not None and timestamp < since) or (until is not None and timestamp > until):
+                latest[move] = None
+                continue
+
+            latest[move] = len(moves)
+            moves.append(move)
+
+        moves = [move for move in moves if move is not None]
+        movable = []
+
+        # Paths that will be taken or freed by the moves back planned so far, for files moved more than once
+        taken = set()
+        freed = set()
+
+        def exists(path: str) -> bool:
+            return path in taken or (path not in freed and os.path.exists(path))
+
+        for old_path, new_path in reversed(moves):
+            if not exists(new_path):
+                print(f"Skipped {new_path}, which no longer exists.")
+            elif exists(old_path):
+                print(f"Skipped {new_path}, as {old_path} already exists.")
+            else:
+                movable.append((old_path, new_path))
+                taken.discard(new_path)
+                freed.add(new_path)
+                freed.discard(old_path)
+                taken.add(old_path)
+
+        # Journal every move back with a single sync before making any of them
+        undo_batch = new_batch()
+        journal_file_movements([(new_path, old_path) for old_path, new_path in movable], undo_batch)
+        undone = 0
+        failed = []
+
+        for old_path, new_path in movable:
+            try:
+                move_file(new_path, old_path, self.config.verify_copies)
+            except OSError as error:
+                failed.append((new_path, old_path))
+                metrics.errors.inc()
+                print(f"Could not move {new_path} back: {error}")
+                continue
+
+            undone += 1
+            print(f"{os.path.basename(old_path)} was moved back from {os.path.dirname(new_path)} to "
+                  f"{os.path.dirname(old_path)}")
+
+        journal_file_movements(failed, undo_batch, cancelled=True)
+        print(f"Undo complete: {undone} of {len(moves)} files moved back as batch {undo_batch}.")
+        return undone
+
+    @staticmethod
+    def batches() -> list[tuple[str, int, float, float]]:
+
+        """Returns the name, number of moves, and first and last move time of every journaled batch, oldest first."""
+
+        batches = {}
+
+        for record in move_journal.read():
+            if record.get("cancelled"):
+                continue
+
+            name = record.get("batch")
+            count, first, _ = batches.get(name, (0, record["timestamp"], None))
+            batches[name] = (count + 1, first, record["timestamp"])
+
+        return [(name, count, first, last) for name, (count, first, last) in batches.items()]
+
+    def update_config(self, commandline_args: dict):
+
+        """Updates the config information with the commandline argument values."""
+
+        with self.lock:
+            self.config.update(commandline_args)
 
     # Static methods
     @staticmethod
-    def get_best_dir(file_path: str) -> Directory:
+    def __scan_files(root: str) -> Iterator[str]:
 
-        """Returns the Directory object that has the most matching tags/is the best fit."""
+        """Streams the paths of the files directly inside the passed directory, skipping downloads in progress."""
 
-        filename = u.filename(file_path)
-        all_matches = []
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_file() and not u.in_progress(entry.path):
+                    yield entry.path
 
-        for directory in Directory.directories.values():
-            matching_tags = directory.matching_tags(filename)  # Get num of matching tags
-            all_matches.append((matching_tags, directory))  # Add tuple to list
+    @staticmethod
+    def __settled_files(file_paths: Iterable[str], settle: float, batch_size: int) -> Iterator[str]:
 
-        return max(all_matches, key=lambda x: x[0])[1]
+        """
+        Streams the files that stayed unchanged for settle seconds, looking at them twice per batch. Files still being
+        written, such as copies from another drive, and placeholders of downloads still being written are skipped.
+        """
+
+        for batch in u.batched(file_paths, batch_size):
+            snapshots = [u.snapshot(file_path) for file_path in batch]
+            time.sleep(settle)
+
+            for file_path, snapshot in zip(batch, snapshots):
+                if snapshot is not None and u.snapshot(file_path) == snapshot and not u.placeholder(file_path):
+                    yield file_path
 
     @staticmethod
-    def search_dirs(dir_name: str) -> list[Directory]:
+    def get_best_dir(file_path: str) -> Directory | None:
 
-        """Returns a list of directories whose paths contain the keyword/name passed."""
+        """
+        Returns the Directory object that has the most matching tags/is the best fit, or None if no directory has a
+        matching tag.
+        """
+
+        directory, _ = Directory.index.best_match(u.filename(file_path))
+        return directory
+
+    @staticmethod
+    def search_dirs(dir_name: str, limit: int = SEARCH_RESULTS) -> list[Directory]:
 
-        matches = []  # Store all matches
+        """
+        Returns up to limit directories whose names best match the keyword/name passed, best match first. Names only
+        need to be similar to the keyword, so small typos are tolerated.
+        """
 
-        for directory in Directory.directories:
-            if dir_name in directory.path.split("\\")[-1]:  # Check the last part of the path to avoid duplicates
-                matches.append(directory)
+        matches = Directory.search_index.search(dir_name, limit)
 
         if len(matches) == 0:
             raise NotADirectoryError(f"No directories matching name {dir_name} can be found.")
@@ -107,7 +817,7 @@ class Application:
 
         """Returns the directory object with the matching path."""
 
-        directory = Directory.directories.get(dir_path)
+        directory = Directory.directories.get(os.path.abspath(dir_path))
 
         if directory:  # If found
             return directory
@@ -117,26 +827,48 @@ class Application:
     @staticmethod
     def load_config() -> Config:
 
-        """Loads the config from a previously saved config file."""
+        """Loads the config from a previously saved config file, along with its directories."""
 
-        # Check if file exists or raise error
-        if not os.path.exists(Config.filename):
-            raise FileNotFoundError("No config file exists. Please create a config file.")
+        config, directories = Config.load()
 
-        with open(Config.filename, "r") as config:
-            data = json.load(config)
+        # Create a directory object for each directory
+        Directory.restore(*directories)
 
-        for directory_path in data["directories"]:
+        return config
 
-            # Create a directory object for each directory
-            Directory(
-                path=directory_path,
-                tags=data["directories"][directory_path]["tags"]
-            )
 
-        # Return a configurations object
-        return Config(
-            watch_dir=data["watch_dir"],
-            ignored_names=data["ignored_names"],
-            ignore_char=data["ignore_char"],
-        )
+# Functions
+auditor = None  # Application of an audit worker process
+
+
+def start_auditor():
+
+    """Loads the configurations in an audit worker process."""
+
+    global auditor
+    auditor = Application()
+
+
+def audit_files(files: list[tuple[str, str, int]]) -> tuple[int, list[tuple[int, dict]]]:
+
+    """
+    Audits a batch of (file path, directory path, directory index) files in a worker process. Returns the number of
+    files audited and the report entries of the misfiled ones, with the index of their directory.
+    """
+
+    import sqlite3  # Only needed by the audit workers, which read the classifier cache
+
+    entries = []
+
+    for file_path, current_path, index in files:
+        try:
+            entry = auditor.audit_file(file_path, current_path)
+        except OSError:  # Removed since it was listed
+            continue
+        except sqlite3.Error as error:  # Such as a classifier cache locked by the sorter, which only costs this file
+            print(f"Could not audit {file_path}: {error}")
+            continue
+        if entry is not None:
+            entries.append((index, entry))
+
+    return len(files), entries
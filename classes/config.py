@@ -2,11 +2,16 @@
 __author__ = "Matteo Golin"
 
 # Imports
-import json
 import os
+from .storage import Storage
 
 # Constants
 CONFIG_FILENAME = "config.json"
+QUIET_WINDOW = 1.0  # Longest wait in seconds between two checks of a file that is still changing
+WORKERS = 4  # Number of files that can be sorted at the same time
+VERIFY_COPIES = False  # Whether files copied to another file system are checked before the original is removed
+CLASSIFY = False  # Whether the content of files is read to find more matching tags
+DEDUPE = "off"  # What is done with files identical to one already in their directory: off, skip, link or discard
 
 
 # Class
@@ -14,25 +19,151 @@ class Config:
 
     filename = CONFIG_FILENAME
 
-    def __init__(self, watch_dir: str, ignored_names: list[str], ignore_char: str):
+    def __init__(
+            self,
+            watch_dir: str,
+            ignored_names: list[str],
+            ignore_char: str,
+            quiet_window: float = QUIET_WINDOW,
+            workers: int = WORKERS,
+            verify_copies: bool = VERIFY_COPIES,
+            classify: bool = CLASSIFY,
+            dedupe: str = DEDUPE,
+    ):
         self.watch_dir = watch_dir
         self.ignored_names = ignored_names
         self.ignore_char = ignore_char
+        self.quiet_window = quiet_window
+        self.workers = workers
+        self.verify_copies = verify_copies
+        self.classify = classify
+        self.dedupe = dedupe
 
-    def save(self, directories: dict):
+        self.storage = Storage(self.filename)
+        self.saved_settings = None  # Settings as of the last save or load, used to detect modifications
 
-        """Save all directories to the config file."""
+    @classmethod
+    def load(cls) -> tuple["Config", tuple]:
 
-        with open(self.filename, "w") as config:
+        """
+        Loads the config from the config file. Returns it along with the columns of the saved directories, which are
+        only turned into directories by the commands that need them.
+        """
 
-            data = {
-                "watch_dir": self.watch_dir,
-                "ignored_names": self.ignored_names,
-                "ignore_char": self.ignore_char,
-                "directories": directories,
-            }
+        storage = Storage(cls.filename)
 
-            json.dump(data, config, default=lambda o: o.to_JSON())  # Lambda allows classes to be serialized
+        # Check if file exists or raise error
+        if not storage.exists():
+            raise FileNotFoundError("No config file exists. Please create a config file.")
+
+        data = storage.load()
+        config = cls(
+            watch_dir=data["watch_dir"],
+            ignored_names=data["ignored_names"],
+            ignore_char=data["ignore_char"],
+            quiet_window=data.get("quiet_window", QUIET_WINDOW),
+            workers=data.get("workers", WORKERS),
+            verify_copies=data.get("verify_copies", VERIFY_COPIES),
+            classify=data.get("classify", CLASSIFY),
+            dedupe=data.get("dedupe", DEDUPE),
+        )
+        config.saved_settings = config.settings()
+        return config, data["directories"]
+
+    def update(self, commandline_args: dict):
+
+        """Updates the settings with the commandline argument values."""
+
+        watch_dir = commandline_args.get("watch_dir")
+        ignore_char = commandline_args.get("ignore_char")
+        ignored_names = commandline_args.get("ignored_names")
+        quiet_window = commandline_args.get("quiet_window")
+        workers = commandline_args.get("workers")
+        verify_copies = commandline_args.get("verify_copies")
+        classify = commandline_args.get("classify")
+        dedupe = commandline_args.get("dedupe")
+
+        if watch_dir:
+            self.watch_dir = watch_dir
+
+        if ignore_char:
+            self.ignore_char = ignore_char
+
+        if ignored_names:
+            self.ignored_names.extend(ignored_names)
+
+        if quiet_window is not None:
+            self.quiet_window = quiet_window
+
+        if workers:
+            self.workers = workers
+
+        if verify_copies is not None:
+            self.verify_copies = verify_copies
+
+        if classify is not None:
+            self.classify = classify
+
+        if dedupe:
+            self.dedupe = dedupe
+
+    def settings(self) -> dict:
+
+        """Returns a copy of all settings, excluding directories."""
+
+        return {
+            "watch_dir": self.watch_dir,
+            "ignored_names": list(self.ignored_names),
+            "ignore_char": self.ignore_char,
+            "quiet_window": self.quiet_window,
+            "workers": self.workers,
+            "verify_copies": self.verify_copies,
+            "classify": self.classify,
+            "dedupe": self.dedupe,
+        }
+
+    def save(self, directories: dict, changes: dict | None = None):
+
+        """
+        Saves the configurations. When the changed directories are passed (path -> directory, or None if the directory
+        was removed), only those and any modified settings are appended to the journal. Otherwise, or once the journal
+        has outgrown the config file, all directories are written to a new config file.
+        """
+
+        settings = self.settings()
+
+        if changes is None or not self.storage.exists() or self.storage.should_compact():
+            data = {**settings, "directories": directories}
+            self.storage.compact(data, default=lambda o: o.to_JSON())  # Lambda allows classes to be serialized
+
+        else:
+            records = []
+
+            if settings != self.saved_settings:
+                records.append({"op": "settings", **settings})
+
+            for path, directory in changes.items():
+                if directory is None:
+                    records.append({"op": "remove", "path": path})
+                else:
+                    records.append({"op": "directory", "path": path, **directory.to_JSON()})
+
+            self.storage.append(records)
+
+        self.saved_settings = settings
+
+    def save_settings(self):
+
+        """
+        Saves only the settings, by appending them to the journal if they were modified. The directories are left as
+        they are, so they do not need to be loaded.
+        """
+
+        settings = self.settings()
+
+        if settings != self.saved_settings:
+            self.storage.append([{"op": "settings", **settings}])
+            self.saved_settings = settings
 
     def delete(self):
 
@@ -42,7 +173,10 @@ class Config:
         os.remove(f"{current_directory}\\{self.filename}")
 
     def __repr__(self):
-        representation = f"Watch: {self.watch_dir} Ignore Character: {self.ignore_char}\nIgnored Names:\n"
+        representation = f"Watch: {self.watch_dir} Ignore Character: {self.ignore_char}\n"
+        representation += f"Quiet Window: {self.quiet_window}s Workers: {self.workers}\n"
+        representation += f"Verify Copies: {self.verify_copies} Classify: {self.classify} Dedupe: {self.dedupe}\n"
+        representation += "Ignored Names:\n"
         for name in self.ignored_names:
             representation += f"{name}\n"
         return f"Config(\n{representation})"
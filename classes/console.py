@@ -53,7 +53,10 @@ class Console:
 
         while True:
             name = input("Enter a directory name: ")  # Get search name
-            results = self.app.search_dirs(name)  # Perform search
+            try:
+                results = self.app.search_dirs(name)  # Perform search
+            except NotADirectoryError:
+                results = []
 
             # Reprompt for keyword
             if len(results) == 0:
@@ -0,0 +1,195 @@
+# Control socket letting command line invocations act on a running sorter instead of loading their own copy
+__author__ = "Matteo Golin"
+
+# Imports
+import json
+import os
+import socket
+import threading
+from typing import Callable
+
+# Constants
+SOCKET_FILE = "pyorganize.sock"  # Unix domain socket of the running sorter
+ADDRESS_FILE = "pyorganize.address"  # Port and token of the running sorter where Unix domain sockets are unavailable
+TIMEOUT = 30.0  # Seconds a client waits for the sorter to answer a request
+
+# Types
+Handler = Callable[[dict], str]
+
+
+# Functions
+def unix_sockets() -> bool:
+
+    """Returns True if the control socket can be a Unix domain socket on this platform."""
+
+    return os.name != "nt" and hasattr(socket, "AF_UNIX")
+
+
+def connect() -> tuple[socket.socket, str] | None:
+
+    """Connects to the running sorter, returning the connection and its token, or None if no sorter is running."""
+
+    try:
+        if unix_sockets():
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address, token = SOCKET_FILE, ""
+        else:
+            with open(ADDRESS_FILE) as file:
+                details = json.load(file)
+            connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address, token = ("127.0.0.1", details["port"]), details["token"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+    try:
+        connection.settimeout(TIMEOUT)
+        connection.connect(address)
+    except OSError:  # Nothing is listening, the files were left behind by a sorter that did not exit cleanly
+        connection.close()
+        return None
+
+    return connection, token
+
+
+def running() -> bool:
+
+    """Returns True if a sorter is running and accepting requests."""
+
+    connected = connect()
+    if connected is None:
+        return False
+
+    connected[0].close()
+    return True
+
+
+def send_request(command: str, arguments: dict) -> dict | None:
+
+    """
+    Sends a command to the running sorter and returns its response, holding whether it succeeded and the output to
+    print. Returns None if no sorter is running, in which case the command should be run locally.
+    """
+
+    connected = connect()
+    if connected is None:
+        return None
+
+    connection, token = connected
+    with connection, connection.makefile("rwb") as stream:
+        stream.write(json.dumps({"token": token, "command": command, "arguments": arguments}).encode() + b"\n")
+        stream.flush()
+        response = stream.readline()
+
+    if not response:
+        return {"ok": False, "output": "The sorter closed the connection without answering."}
+
+    return json.loads(response)
+
+
+# Class
+class ControlServer:
+
+    """
+    Serves requests from command line invocations while the sorter runs, on an asyncio event loop in a background
+    thread. Requests are answered one at a time on a single worker thread, so the sorter stays the only writer of the
+    configurations. The socket is a Unix domain socket where available, and otherwise a localhost TCP port whose
+    number and a token that requests must carry are written to a file.
+    """
+
+    def __init__(self, handlers: dict[str, Handler]):
+        import secrets  # Only needed by the sorter, not by the command line clients
+
+        self.handlers = handlers
+        self.token = secrets.token_hex(16)
+
+        self.loop = None
+        self.stopping = None
+        self.thread = None
+        self.ready = threading.Event()
+
+    # Methods
+    def start(self):
+
+        """Starts serving requests, returning once the socket is accepting connections."""
+
+        self.thread = threading.Thread(target=self.__run, name="control", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def stop(self):
+
+        """Stops serving requests, waiting for the request being answered, and removes the socket files."""
+
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+            self.thread.join()
+
+    def __run(self):
+
+        """Runs the event loop of the server until stopped."""
+
+        import asyncio  # Only needed by the sorter, not by the command line clients
+
+        asyncio.run(self.__serve(asyncio))
+
+    async def __serve(self, asyncio):
+
+        """Listens on the control socket until stopped."""
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="control-worker")
+
+        async def handle(reader, writer):
+            try:
+                line = await reader.readline()
+                response = await self.loop.run_in_executor(executor, self.__answer, line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                writer.close()
+
+        if unix_sockets():
+            if os.path.exists(SOCKET_FILE):
+                os.remove(SOCKET_FILE)  # Left behind by a sorter that did not exit cleanly
+            server = await asyncio.start_unix_server(handle, path=SOCKET_FILE)
+        else:
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            with open(ADDRESS_FILE, "w") as file:
+                json.dump({"port": server.sockets[0].getsockname()[1], "token": self.token}, file)
+
+        self.ready.set()
+
+        try:
+            async with server:
+                await self.stopping.wait()
+        finally:
+            executor.shutdown(wait=True)
+            for path in (SOCKET_FILE, ADDRESS_FILE):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def __answer(self, line: bytes) -> dict:
+
+        """Runs the requested command and returns the response."""
+
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {"ok": False, "output": "The request could not be read."}
+
+        if not unix_sockets() and request.get("token") != self.token:
+            return {"ok": False, "output": "The request was not authorized."}
+
+        handler = self.handlers.get(request.get("command"))
+        if handler is None:
+            return {"ok": False, "output": f"The sorter does not accept the {request.get('command')} command."}
+
+        try:
+            return {"ok": True, "output": handler(request.get("arguments", {}))}
+        except (OSError, ValueError) as error:
+            return {"ok": False, "output": str(error)}
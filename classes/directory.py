@@ -5,7 +5,25 @@ __author__ = "Matteo Golin"
 
 # Imports
 import os
+import re
+import sys
+import threading
+import time
+from utils.files import link_file, move_file
+from utils.walk import walk_directories
+from utils.journal import journal_file_movement
 from utils.logging import log_file_movement
+import utils.metrics as metrics
+from .directory_table import DirectoryTable
+from .name_index import NameIndex
+from .path_trie import PathTrie
+from .tag_index import TagIndex
+
+# Constants
+COUNTED_NAME = re.compile(r"(.*) \((\d+)\)")  # Name of a file nested next to another file with the same name
+MAX_NAME_ATTEMPTS = 100  # Names tried for a file before giving up, if something else keeps taking them
+
+EMPTY_TAGS = frozenset()
 
 # Types
 TagList = list[str]
@@ -14,64 +32,122 @@ TagList = list[str]
 # Class
 class Directory:
 
-    directories = {}
+    """
+    A directory files can be sorted into. Its own tags only apply to itself, while its recursive tags also apply to
+    every registered directory below it, which inherits them without storing a copy. The effective tags of a
+    directory are worked out the first time they are needed and cached until any recursive tags or the tree change.
+    Tag sets are immutable so that directories with the same tags can share them.
+    """
+
+    __slots__ = (
+        "path", "tags", "recursive_tags", "inherited", "effective", "cached_generation", "names", "names_mtime"
+    )
+
+    directories = DirectoryTable()
+    tree = PathTrie(lambda: Directory.directories.values())  # The same directories, organized by path
+    search_index = NameIndex(lambda: Directory.directories.values())  # The same directories, searchable by name
+    changes = {}  # Path -> directory (or None if removed) for every change since the config was last saved
+    index = TagIndex(lambda: Directory.directories.values())  # The same directories, by tag
+    naming_lock = threading.Lock()
+    ignored_names = []  # Names of directories that are never entered when adding tags recursively
+    tag_generation = 0  # Increased whenever inherited tags may have changed, invalidating cached effective tags
+    inheriting = False  # Whether any directory has recursive tags, if not there is nothing to inherit
 
     def __init__(self, path: str, tags: TagList, recursive: bool = False, parent_tags: bool = False):
-        self.path = path
-        self.tags = set(tags)
-
-        # Recursive tags
+        self.path = os.path.abspath(path)  # Absolute, like the paths of the file system events that move it
+        self.tags = EMPTY_TAGS
+        self.recursive_tags = EMPTY_TAGS
+        self.inherited = EMPTY_TAGS
+        self.effective = EMPTY_TAGS
+        self.cached_generation = None
+
+        # Highest counter used per file name and extension, with the directory modification time it was indexed at
+        self.names = None
+        self.names_mtime = None
+
+        # Save directory to master dict of directories before any children are created
+        self.__register()
+        self.add_tags(tags, recursive)
+
+        # Register the subdirectories, which inherit the recursive tags
         if recursive:
-            self.__add_tags_children(list(self.tags))
+            self.__register_children()
 
         # Add parent tags
         if parent_tags:
             self.add_parent_tags(recursive=recursive)
 
-        # Save directory to master dict of directories
-        self.directories[self.path] = self
-
     # Methods
-    def __add_tags_children(self, tags: str | TagList):
+    def __register(self):
 
-        """Adds tags to child directories."""
+        """Saves the directory to the master dict of directories, replacing any directory with the same path."""
 
-        subdirectories = os.walk(self.path)
+        previous = self.directories.get(self.path)
+        if previous is not None:
+            self.index.discard(previous)
+            self.search_index.remove(previous)
+            if previous.recursive_tags:
+                self.invalidate_tags()
 
-        for dir_path, _, _ in subdirectories:
-            directory = self.directories.get(dir_path)
+        self.directories[self.path] = self
+        self.tree.insert(self.path, self)
+        self.search_index.add(self)
+        self.changes[self.path] = self
+        self.index.register(self)
+
+    def __register_children(self):
+
+        """
+        Registers the subdirectories that are not registered yet, without tags of their own, skipping directories with
+        ignored names and everything below them.
+        """
 
-            if directory:  # Already exists as object
-                directory.add_tags(tags)
-            else:  # Must be created
+        for dir_path in walk_directories(self.path, self.ignored_names):
+            if dir_path not in self.directories:
                 Directory(
                     path=dir_path,
-                    tags=tags
+                    tags=[]
                 )
 
     def add_tags(self, tags: str | TagList, recursive: bool = False):
 
-        """Adds a tag or multiple tags to the tag list."""
+        """
+        Adds a tag or multiple tags to the tag list. In recursive mode, the tags are added to the recursive tags
+        instead, which every directory below this one inherits, including directories registered later.
+        """
 
         # Convert to list if single tag is passed as string
         if type(tags) is str:
             tags = [tags]
 
-        if recursive:
-            self.__add_tags_children(tags)
+        current = self.recursive_tags if recursive else self.tags
+        new = frozenset(sys.intern(tag) for tag in tags) - current
+        if not new:
+            return
 
+        if recursive:
+            self.recursive_tags = current | new
+            Directory.inheriting = True
+            self.invalidate_tags()
         else:
-            self.tags.update(tags)
+            self.tags = current | new
+            self.cached_generation = None
+
+        for tag in new:
+            self.index.add(self, tag)
+        self.changes[self.path] = self
 
     def add_parent_tags(self, recursive: bool = False):
 
-        """Adds tags of the parent directory to itself, and its children if recursive mode is selected."""
+        """
+        Adds tags of the parent directory to itself, and its children if recursive mode is selected. The parent is the
+        nearest directory above this one that is registered. Tags that are already inherited from it are skipped.
+        """
 
-        parent_path = self.path.split("\\")[:-1]
-        parent = self.directories.get(parent_path)
+        parent = self.tree.parent(self.path)
 
         if parent:
-            self.add_tags(parent.tags, recursive=recursive)
+            self.add_tags(list(parent.effective_tags() - self.inherited_tags()), recursive=recursive)
         else:
             raise NotADirectoryError(
                 "Parent directory is not specified in the configurations file. Please add the parent directory "
@@ -80,51 +156,338 @@ class Directory:
 
     def remove_tag(self, tag_name: str):
 
-        """Removes tag from tags list."""
+        """
+        Removes tag from tags list, whether it is an own or a recursive tag. Inherited tags can only be removed from
+        the directory they are inherited from.
+        """
+
+        if tag_name not in self.tags and tag_name not in self.recursive_tags:
+            raise KeyError(tag_name)
+
+        if tag_name in self.recursive_tags:
+            self.recursive_tags = self.recursive_tags - {tag_name}
+            self.invalidate_tags()
+
+        self.tags = self.tags - {tag_name}
+        self.cached_generation = None
+        self.index.remove(self, tag_name)
+        self.changes[self.path] = self
+
+    def effective_tags(self) -> frozenset[str]:
+
+        """Returns every tag that applies to the directory: its own and recursive tags, and the inherited ones."""
+
+        self.__refresh_tags()
+        return self.effective
+
+    def inherited_tags(self) -> frozenset[str]:
+
+        """Returns the recursive tags of the registered directories above this one."""
+
+        self.__refresh_tags()
+        return self.inherited
 
-        self.tags.remove(tag_name)
+    def inheritors(self) -> list[Directory]:
 
-    def nest_file(self, file_path: str):
+        """Returns the directories its recursive tags apply to: itself and every registered directory below it."""
 
-        """Nests the passed file within itself."""
+        return list(self.tree.subtree(self.path))
 
-        file = file_path.split("\\")[-1]
-        file_name, file_ext = file.split(".")
+    def __refresh_tags(self):
+
+        """
+        Works out the inherited and effective tags if they are not cached for the current generation. Sets are
+        reused rather than copied wherever nothing is added to them, so a tree inheriting the same tags shares them.
+        """
+
+        generation = self.tag_generation  # Read first, so that a change made meanwhile is picked up next time
+        if self.cached_generation == generation:
+            return
+
+        inherited = EMPTY_TAGS
+        if self.inheriting:
+            parent = self.tree.parent(self.path)
+            if parent is not None:
+                inherited = parent.inherited_tags()
+                if parent.recursive_tags:
+                    inherited = parent.recursive_tags | inherited if inherited else parent.recursive_tags
+
+        own = self.tags | self.recursive_tags if self.recursive_tags else self.tags
+        if not own:
+            effective = inherited
+        elif not inherited:
+            effective = own
+        else:
+            effective = own | inherited
+
+        self.inherited = inherited
+        self.effective = effective
+        self.cached_generation = generation
+
+    def nest_file(
+            self,
+            file_path: str,
+            score: int | None = None,
+            verify: bool = False,
+            batch: str | None = None,
+            link_to: str | None = None,
+            reserved: str | None = None,
+    ) -> str:
+
+        """
+        Nests the passed file within itself, returning its new path. The score is only used for logging. If the file
+        has to be copied to another file system, verify checks the copy against the original before it is removed.
+        The move is journaled under the passed batch before it happens, so that it can be undone. If an identical file
+        is passed as link_to, the file is nested as a hard link to it where possible. A path returned by reserve_path
+        whose move was already journaled can be passed as reserved, and is tried first without journaling it again.
+        """
+
+        start = time.perf_counter()
+        new_path = reserved
 
         # Increase counter on filename if file already exists in directory
-        counter = 1
-        counted_file_name = file_name
-        while os.path.exists(f"{self.path}\\{counted_file_name}.{file_ext}"):
-            counted_file_name = f"{file_name} ({counter})"
-            counter += 1
+        for _ in range(MAX_NAME_ATTEMPTS):
+            if new_path is None:
+                new_path = self.reserve_path(file_path)
+                journal_file_movement(file_path, new_path, batch)
+            try:
+                if link_to is None:
+                    move_file(file_path, new_path, verify)
+                else:
+                    link_file(link_to, new_path, file_path, verify)
+                break
+            except FileExistsError:  # Created by something else since the names were indexed
+                journal_file_movement(file_path, new_path, batch, cancelled=True)
+                new_path = None
+                with self.naming_lock:
+                    self.names = None
+            except OSError:
+                journal_file_movement(file_path, new_path, batch, cancelled=True)
+                raise
+        else:
+            raise FileExistsError(f"No free name for {file_path} was found in {self.path}.")
+
+        # The directory changed because of this rename, which is already accounted for in the names
+        with self.naming_lock:
+            if self.names is not None:
+                self.names_mtime = os.stat(self.path).st_mtime_ns
 
-        new_path = f"{self.path}\\{counted_file_name}.{file_ext}"
-        os.rename(file_path, new_path)
+        moved = time.perf_counter()
+        metrics.rename_seconds.observe(moved - start)
+        metrics.files_moved.inc()
 
         # Logging
-        log_file_movement(file_path, new_path)
+        log_file_movement(file_path, new_path, self.path, score, moved - start)
+        metrics.log_seconds.observe(time.perf_counter() - moved)
+
+        return new_path
+
+    def reserve_path(self, file_path: str) -> str:
+
+        """Returns a free path in the directory for the passed file, which no other file is given until re-indexed."""
+
+        file_name, file_ext = os.path.splitext(os.path.basename(file_path))
+        return self.__reserve_name(file_name, file_ext)
+
+    def __reserve_name(self, file_name: str, file_ext: str) -> str:
+
+        """
+        Returns a free path for a file with the passed name and extension, counting up from the highest counter used
+        by the existing files with that name. A name that already has a counter, like a re-download, is counted with
+        the names it was counted from, and kept if its counter is higher than any in use. The names are indexed on
+        first use and re-indexed whenever the directory was modified by something else.
+        """
+
+        base_name, own_counter = file_name, None
+        match = COUNTED_NAME.fullmatch(file_name)
+        if match:
+            base_name, own_counter = match.group(1), int(match.group(2))
+
+        key = (os.path.normcase(base_name), os.path.normcase(file_ext))
+
+        with self.naming_lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            if self.names is None or self.names_mtime != mtime:
+                self.names = self.__index_names()
+                self.names_mtime = mtime
+
+            counter = self.names.get(key)
+            if counter is None or (own_counter is not None and own_counter > counter):
+                self.names[key] = own_counter or 0
+                return os.path.join(self.path, f"{file_name}{file_ext}")
+
+            self.names[key] = counter + 1
+            return os.path.join(self.path, f"{base_name} ({counter + 1}){file_ext}")
+
+    def __index_names(self) -> dict[tuple[str, str], int]:
+
+        """Returns the highest counter used by the files in the directory for each name and extension."""
+
+        names = {}
+
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                file_name, file_ext = os.path.splitext(entry.name)
+
+                match = COUNTED_NAME.fullmatch(file_name)
+                if match:
+                    file_name, counter = match.group(1), int(match.group(2))
+                else:
+                    counter = 0
+
+                key = (os.path.normcase(file_name), os.path.normcase(file_ext))
+                names[key] = max(counter, names.get(key, 0))
+
+        return names
 
     def matching_tags(self, filename: str) -> int:
 
         """Returns the number of tags matching the passed filename."""
 
         matching_tags = 0
-        for tag in self.tags:
+        for tag in self.effective_tags():
             if tag in filename.lower():
                 matching_tags += 1
 
         return matching_tags
 
+    @classmethod
+    def restore(cls, paths: list[str], columns: dict[str, list]):
+
+        """
+        Registers saved directories in bulk from the columns loaded from the config, whose tags are frozen sets shared
+        by the directories with the same tags. Each directory is only created when it is first looked up, and the
+        tag index, trie and search index read them once they are first used. No recursion is done and the
+        directories are not marked as changed, since they are already saved.
+        """
+
+        cls.directories.restore(paths, columns, cls.__restore_row)
+        cls.index.register_all(paths)
+        cls.inheriting = cls.inheriting or any(columns.get("recursive_tags") or ())
+        cls.invalidate_tags()
+
+        # Only needed if they were used before the restore, otherwise they read the restored directories when built
+        if cls.index.built or cls.tree.built or cls.search_index.built:
+            restored = [cls.directories[path] for path in paths]
+            cls.index.add_all(restored)
+
+            for directory in restored:
+                cls.tree.insert(directory.path, directory)
+                cls.search_index.add(directory)
+
+    @classmethod
+    def __restore_row(cls, path: str, columns: dict[str, list], row: int) -> Directory:
+
+        """Creates a saved directory from its row in the columns loaded from the config."""
+
+        tags = columns.get("tags")
+        recursive_tags = columns.get("recursive_tags")
+
+        directory = cls.__new__(cls)
+        directory.path = path
+        directory.tags = tags and tags[row] or EMPTY_TAGS
+        directory.recursive_tags = recursive_tags and recursive_tags[row] or EMPTY_TAGS
+        directory.inherited = EMPTY_TAGS
+        directory.effective = EMPTY_TAGS
+        directory.cached_generation = None
+        directory.names = None
+        directory.names_mtime = None
+        return directory
+
+    @classmethod
+    def move_tree(cls, old_path: str, new_path: str) -> list[Directory]:
+
+        """
+        Moves the directory at the old path and every registered directory below it to the new path, in memory only.
+        Returns the moved directories.
+        """
+
+        old_path, new_path = os.path.abspath(old_path), os.path.abspath(new_path)
+
+        with cls.tree.lock:
+            moved = cls.tree.move(old_path, new_path)
+
+            for directory in moved:
+                relative_path = os.path.relpath(directory.path, old_path)
+                previous_path = directory.path
+                cls.search_index.remove(directory)
+                directory.path = new_path if relative_path == os.curdir else os.path.join(new_path, relative_path)
+                cls.search_index.add(directory)
+
+                del cls.directories[previous_path]
+                cls.directories[directory.path] = directory
+                cls.index.rename(previous_path, directory.path)
+
+                cls.changes[previous_path] = None
+                cls.changes[directory.path] = directory
+
+            cls.invalidate_tags()  # The moved directories may now be below other directories
+
+        return moved
+
+    @classmethod
+    def remove_tree(cls, path: str) -> list[Directory]:
+
+        """Unregisters the directory at the passed path and every registered directory below it."""
+
+        path = os.path.abspath(path)
+
+        with cls.tree.lock:
+            removed = list(cls.tree.subtree(path))
+
+            for directory in removed:
+                cls.tree.remove(directory.path)
+                cls.directories.pop(directory.path, None)
+                cls.index.discard(directory)
+                cls.search_index.remove(directory)
+                cls.changes[directory.path] = None
+
+            cls.invalidate_tags()
+
+        return removed
+
+    @classmethod
+    def invalidate_tags(cls):
+
+        """Discards the cached effective tags of every directory, along with the routing decisions based on them."""
+
+        cls.tag_generation += 1
+        cls.index.invalidate()
+
+    @classmethod
+    def pop_changes(cls) -> dict:
+
+        """Returns the directories changed since the last call and starts tracking changes anew."""
+
+        changes = cls.changes
+        cls.changes = {}
+        return changes
+
+    @classmethod
+    def reset(cls):
+
+        """Forgets every registered directory and change, as if in a new process, along with the indexes of them."""
+
+        cls.directories = DirectoryTable()
+        cls.tree = PathTrie(lambda: cls.directories.values())
+        cls.search_index = NameIndex(lambda: cls.directories.values())
+        cls.changes = {}
+        cls.index = TagIndex(lambda: cls.directories.values())
+        cls.inheriting = False
+
     def __repr__(self):
-        return f"{self.path} <{self.tags}>"
+        return f"{self.path} <{set(self.effective_tags())}>"
 
     # Properties
     def to_JSON(self):
 
-        """JSON serialization."""
+        """JSON serialization. Inherited tags are not written, and recursive tags only if there are any."""
 
         representation = {
             "tags": list(self.tags),
         }
 
+        if self.recursive_tags:
+            representation["recursive_tags"] = list(self.recursive_tags)
+
         return representation
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+# Mapping of the registered directories by path, creating the directories restored from the config as they are needed
+__author__ = "Matteo Golin"
+
+# Imports
+import threading
+from collections.abc import MutableMapping
+from typing import TYPE_CHECKING, Callable, Iterator
+
+if TYPE_CHECKING:
+    from .directory import Directory
+
+# Types
+Factory = Callable[[str, dict[str, list], int], "Directory"]  # Creates a directory from its path and row in the columns
+
+
+# Class
+class DirectoryTable(MutableMapping):
+
+    """
+    The registered directories by path. Directories restored from the columns of the config are only created the first
+    time they are looked up, so commands that touch a few directories do not create all of them. Listing the
+    directories creates the remaining ones, in the order they were saved in.
+    """
+
+    def __init__(self):
+        self.loaded = {}  # Path -> directory, for the directories created so far
+        self.rows = {}  # Path -> row in the columns, for every restored directory that was not removed
+        self.columns = {}
+        self.factory = None
+        self.unloaded = 0  # Restored directories that were not created yet
+        self.lock = threading.RLock()
+
+    # Methods
+    def restore(self, paths: list[str], columns: dict[str, list], factory: Factory):
+
+        """Registers saved directories without creating them, replacing any registered directory with the same path."""
+
+        with self.lock:
+            self.__load_all()  # Directories restored before are created from their own columns
+
+            self.rows = dict(zip(paths, range(len(paths))))
+            self.columns = columns
+            self.factory = factory
+            self.unloaded = len(self.rows)
+
+            for path in self.rows.keys() & self.loaded.keys():
+                del self.loaded[path]
+
+    def get(self, path: str, default=None) -> Directory | None:
+        directory = self.loaded.get(path)
+        if directory is not None:
+            return directory
+
+        return self.__create(path) if path in self.rows else default
+
+    def to_JSON(self) -> dict[str, Directory]:
+
+        """JSON serialization, creating every directory."""
+
+        with self.lock:
+            self.__load_all()
+            return self.loaded
+
+    def values(self):
+        with self.lock:
+            self.__load_all()
+            return self.loaded.values()
+
+    def items(self):
+        with self.lock:
+            self.__load_all()
+            return self.loaded.items()
+
+    def __create(self, path: str) -> Directory | None:
+
+        """Creates the restored directory at the passed path, unless another thread already did."""
+
+        with self.lock:
+            directory = self.loaded.get(path)
+            if directory is None and path in self.rows:
+                directory = self.factory(path, self.columns, self.rows[path])
+                self.loaded[path] = directory
+                self.unloaded -= 1
+
+            return directory
+
+    def __load_all(self):
+
+        """Creates every restored directory that was not created yet, keeping the order they were saved in."""
+
+        if not self.rows:
+            return
+
+        loaded = {}
+        for path, row in self.rows.items():
+            directory = self.loaded.pop(path, None)
+            loaded[path] = directory if directory is not None else self.factory(path, self.columns, row)
+
+        loaded.update(self.loaded)  # Registered after the restore
+        self.loaded = loaded
+        self.rows = {}
+        self.columns = {}
+        self.unloaded = 0
+
+    def __getitem__(self, path: str) -> Directory:
+        directory = self.get(path)
+        if directory is None:
+            raise KeyError(path)
+
+        return directory
+
+    def __setitem__(self, path: str, directory: Directory):
+        with self.lock:
+            if path in self.rows and path not in self.loaded:
+                self.unloaded -= 1
+            self.loaded[path] = directory
+
+    def __delitem__(self, path: str):
+        with self.lock:
+            if path in self.rows:
+                if path not in self.loaded:
+                    self.unloaded -= 1
+                del self.rows[path]
+            elif path not in self.loaded:
+                raise KeyError(path)
+
+            self.loaded.pop(path, None)
+
+    def __contains__(self, path) -> bool:
+        return path in self.loaded or path in self.rows
+
+    def __iter__(self) -> Iterator[str]:
+        with self.lock:
+            self.__load_all()
+            return iter(self.loaded)
+
+    def __len__(self) -> int:
+        return len(self.loaded) + self.unloaded
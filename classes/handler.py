@@ -2,32 +2,45 @@
 __author__ = "Matteo Golin"
 
 # Imports
-import time
 import os
+import threading
+import time
+from typing import Callable
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from .application import Application
+from .control import ControlServer
+from .directory import Directory
+from .pipeline import SortPipeline
+import utils.metrics as metrics
 
 
 # Class to watch homed directory
 class WatchDir:
 
-    def __init__(self, app: Application):
+    def __init__(self, app: Application, metrics_file: str | None = None, metrics_port: int | None = None):
         self.app = app
         self.observer = Observer()
-
-    def run(self, initial_sort):
-        event_handler = Handler(self.app, debug=False)  # Custom event handler
-
+        self.pipeline = SortPipeline(app, quiet_window=app.config.quiet_window, workers=app.config.workers)
+        self.exporter = metrics.Exporter(metrics.registry, file_path=metrics_file, port=metrics_port)
+        self.control = ControlServer(app.requests())
+        self.directory_handler = DirectoryHandler(app, on_change=self.watch_directories)
+        self.watches = {}  # (path, recursive) -> watch following registered directories outside the watched directory
+        self.watch_lock = threading.Lock()
+
+    def run(self, initial_sort: bool, workers: int | None = None):
+        event_handler = Handler(self.app, self.pipeline, debug=False)  # Custom event handler
+
+        self.exporter.start()
+        self.control.start()
+        self.pipeline.start()
         self.observer.schedule(event_handler, self.app.config.watch_dir, recursive=True)
+        self.watch_directories()
         self.observer.start()
 
-        # Initial sort logic
+        # Initial sort logic, live events keep being sorted by the pipeline in the meantime
         if initial_sort:
-            for file in os.listdir(self.app.config.watch_dir):
-                file_path = f"{self.app.config.watch_dir}\\{file}"
-                if os.path.isfile(file_path):
-                    self.app.sort_file(file_path)
+            self.app.sort_directory(self.app.config.watch_dir, workers=workers or self.app.config.workers)
 
         try:
             while True:
@@ -37,39 +50,129 @@ class WatchDir:
             print("Sorter terminated.")
         finally:
             self.observer.join()
+            self.control.stop()
+            self.pipeline.stop()
+            self.exporter.stop()
             self.app.clean_up()
 
+    def watch_directories(self):
+
+        """
+        Watches the trees of registered directories for directory moves and deletions, so that the configurations
+        follow them, and the parent of each tree without recursion, so that renaming the top directory is seen too.
+        Trees inside the watched directory are already covered by its watch. Called again after registered
+        directories moved, as a watch keeps reporting the path it was scheduled with.
+        """
+
+        watch_dir = os.path.abspath(self.app.config.watch_dir)
+        wanted = {}
+
+        for root in Directory.tree.roots():
+            path = os.path.abspath(root.path)
+            if inside(path, watch_dir) or not os.path.isdir(path):
+                continue
+
+            wanted[(path, True)] = None
+            parent = os.path.dirname(path)
+            if parent != path and not inside(parent, watch_dir):
+                wanted[(parent, False)] = None
+
+        with self.watch_lock:
+            for key in self.watches.keys() - wanted.keys():
+                self.observer.unschedule(self.watches.pop(key))
+
+            for path, recursive in wanted.keys() - self.watches.keys():
+                try:
+                    self.watches[(path, recursive)] = self.observer.schedule(
+                        self.directory_handler, path, recursive=recursive
+                    )
+                except OSError as error:  # Removed since the roots were listed
+                    print(f"Could not watch {path}: {error}")
+
 
 class Handler(FileSystemEventHandler):
 
-    def __init__(self, app: Application, debug=False):
+    def __init__(self, app: Application, pipeline: SortPipeline, debug=False):
         super(Handler, self).__init__()
         self.app = app
+        self.pipeline = pipeline
         self.debug = debug
 
     def on_any_event(self, event):
 
         """
         Creation events can be ignored, as they always trigger a modification event immediately afterwards, which is
-        used as a signal.
+        used as a signal. Files are only queued here; the pipeline waits for them to settle and sorts them on its
+        workers so that the observer thread is never blocked.
         """
 
         # Debugging
         if self.debug:
             print(event)
 
+        metrics.events_received.inc()
+
         # Move file to the directory it belongs in whenever a new file is detected
         if event.event_type in ["modified", "moved"] and not event.is_directory:
 
-            time.sleep(1)  # Prevents error window in some cases
-
             # Get filepath
             if event.event_type == "modified":
                 file_path = event.src_path
             else:
                 file_path = event.dest_path
 
-            self.app.sort_file(file_path)
+            self.pipeline.submit(file_path)
+
+        # Keep registered directories up to date when they are moved or deleted
+        elif event.event_type == "moved" and event.is_directory:
+            follow(self.app.move_directory, event.src_path, event.dest_path)
+
+        elif event.event_type == "deleted" and event.is_directory:
+            follow(self.app.remove_directory, event.src_path)
+
+
+class DirectoryHandler(FileSystemEventHandler):
+
+    """
+    Follows moves and deletions of registered directories outside the watched directory, then calls on_change so
+    that the watches can follow them as well.
+    """
+
+    def __init__(self, app: Application, on_change: Callable[[], None]):
+        super(DirectoryHandler, self).__init__()
+        self.app = app
+        self.on_change = on_change
+
+    def on_moved(self, event):
+        if event.is_directory and follow(self.app.move_directory, event.src_path, event.dest_path):
+            self.on_change()
+
+    def on_deleted(self, event):
+        if event.is_directory and follow(self.app.remove_directory, event.src_path):
+            self.on_change()
+
+
+# Functions
+def inside(path: str, directory: str) -> bool:
+
+    """Returns True if the absolute path is the directory or below it."""
+
+    try:
+        return os.path.commonpath([path, directory]) == directory
+    except ValueError:  # On different drives
+        return False
+
+
+def follow(update: Callable[..., list], *paths: str) -> bool:
+
+    """
+    Applies a directory move or deletion to the registered directories, returning True if any were affected. Errors
+    are reported rather than raised, as they would otherwise stop the observer thread and with it all sorting.
+    """
 
-        elif event.event_type in ["modified", "moved"] and event.is_directory:
-            pass  # TODO update directory path if an object is moved
+    try:
+        return bool(update(*paths))
+    except (OSError, ValueError) as error:
+        metrics.errors.inc()
+        print(f"Could not follow the directory change of {' to '.join(paths)}: {error}")
+        return False
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+# Base of the indexes kept over the registered directories
+__author__ = "Matteo Golin"
+
+# Imports
+from typing import TYPE_CHECKING, Callable, Iterable
+
+if TYPE_CHECKING:
+    from .directory import Directory
+
+
+# Class
+class LazyIndex:
+
+    """
+    An index over the registered directories that is only built from its source the first time it is read, so
+    commands that never read it do not pay for it. Until then, changes to the directories are not applied to it, as
+    the source already holds them, and from then on they keep it up to date.
+    """
+
+    def __init__(self, source: Callable[[], Iterable[Directory]]):
+        self.source = source
+        self.built = False
+
+    # Methods
+    def build(self):
+
+        """Builds the index from every directory in the source, if it has not been done yet."""
+
+        if self.built:
+            return
+
+        self.built = True
+        self.populate(self.source())
+
+    def populate(self, directories: Iterable[Directory]):
+
+        """Adds the directories to the index while it is being built."""
+
+        raise NotImplementedError
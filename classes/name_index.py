@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+# Trigram index of directory names for fast, typo tolerant directory searches
+__author__ = "Matteo Golin"
+
+# Imports
+import heapq
+import os
+import sys
+import threading
+from typing import TYPE_CHECKING, Callable, Iterable
+from .lazy_index import LazyIndex
+
+if TYPE_CHECKING:
+    from .directory import Directory
+
+# Constants
+MIN_SIMILARITY = 0.3  # Share of trigrams a name must have in common with the query to be a result
+EXACT_BONUS = 1.0
+PREFIX_BONUS = 0.5
+SUBSTRING_BONUS = 0.25
+
+
+# Class
+class NameIndex(LazyIndex):
+
+    """
+    Inverted index from the trigrams of directory names to the directories. A search only looks at directories that
+    share a trigram with the query, and ranks them by trigram similarity, so names with small typos are still found.
+    Built on the first search.
+    """
+
+    def __init__(self, source: Callable[[], Iterable[Directory]]):
+        super(NameIndex, self).__init__(source)
+        self.postings = {}  # Trigram -> directories whose name contains it
+        self.grams = {}  # Directory -> the trigrams it was indexed under
+        self.lock = threading.RLock()
+
+    # Methods
+    def add(self, directory: Directory):
+
+        """Indexes the name of the directory."""
+
+        with self.lock:
+            if not self.built:  # The directory will be read from the source when the index is built
+                return
+
+            grams = trigrams(name_of(directory.path))
+            self.grams[directory] = grams
+            for gram in grams:
+                self.postings.setdefault(gram, set()).add(directory)
+
+    def remove(self, directory: Directory):
+
+        """Removes the directory from the index, using the name it was indexed under."""
+
+        with self.lock:
+            for gram in self.grams.pop(directory, ()):
+                directories = self.postings[gram]
+                directories.discard(directory)
+                if not directories:
+                    del self.postings[gram]
+
+    def search(self, query: str, limit: int) -> list[Directory]:
+
+        """Returns up to limit directories whose names best match the query, best match first."""
+
+        query = query.lower().strip()
+        if not query:
+            return []
+
+        query_grams = trigrams(query)
+
+        shared = {}
+        with self.lock:
+            self.build()
+            for gram in query_grams:
+                for directory in self.postings.get(gram, ()):
+                    shared[directory] = shared.get(directory, 0) + 1
+            sizes = {directory: len(self.grams[directory]) for directory in shared}
+
+        results = []
+        for directory, count in shared.items():
+            score = 2 * count / (len(query_grams) + sizes[directory])  # Dice coefficient of the trigram sets
+
+            name = name_of(directory.path).lower()
+            if name == query:
+                score += EXACT_BONUS
+            elif name.startswith(query):
+                score += PREFIX_BONUS
+            elif query in name:
+                score += SUBSTRING_BONUS
+            elif score < MIN_SIMILARITY:
+                continue
+
+            results.append((score, directory))
+
+        best = heapq.nsmallest(limit, results, key=lambda result: (-result[0], result[1].path))
+        return [directory for _, directory in best]
+
+    def populate(self, directories: Iterable[Directory]):
+
+        """Indexes the directories while the index is being built."""
+
+        for directory in directories:
+            self.add(directory)
+
+
+# Functions
+def name_of(path: str) -> str:
+
+    """Returns the last component of a directory path."""
+
+    return os.path.basename(os.path.normpath(path))
+
+
+def trigrams(name: str) -> frozenset[str]:
+
+    """Returns the set of three character sequences in the name, padded so that short names have trigrams too."""
+
+    padded = f"  {name.lower()} "
+    return frozenset(sys.intern(padded[start:start + 3]) for start in range(len(padded) - 2))
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+# Trie of directory paths for finding parents, ancestors and subtrees without touching the disk
+__author__ = "Matteo Golin"
+
+# Imports
+import os
+import threading
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator
+from .lazy_index import LazyIndex
+
+if TYPE_CHECKING:
+    from .directory import Directory
+
+
+# Classes
+class Node:
+
+    """A path component, holding the directory registered at that path if there is one."""
+
+    __slots__ = ("children", "directory")
+
+    def __init__(self):
+        self.children = {}
+        self.directory = None
+
+
+class PathTrie(LazyIndex):
+
+    """
+    Directories organized by the components of their paths. Looking up a parent or the ancestors of a path takes time
+    proportional to its depth, and a registered subtree can be listed or moved without any disk access. Built the
+    first time it is read.
+    """
+
+    def __init__(self, source: Callable[[], Iterable[Directory]]):
+        super(PathTrie, self).__init__(source)
+        self.root = Node()
+        self.lock = threading.RLock()
+
+    # Methods
+    def insert(self, path: str, directory: Directory):
+
+        """Registers a directory at the passed path."""
+
+        with self.lock:
+            if not self.built:  # The directory will be read from the source when the trie is built
+                return
+
+            node = self.root
+            for component in split(path):
+                node = node.children.setdefault(component, Node())
+            node.directory = directory
+
+    def remove(self, path: str) -> Directory | None:
+
+        """Unregisters the directory at the passed path, keeping the directories below it. Returns the directory."""
+
+        with self.lock:
+            if not self.built:
+                return None
+
+            nodes = self.__nodes(path)
+            if nodes is None:
+                return None
+
+            directory = nodes[-1].directory
+            nodes[-1].directory = None
+            self.__prune(nodes, split(path))
+            return directory
+
+    def get(self, path: str) -> Directory | None:
+
+        """Returns the directory registered at the passed path."""
+
+        with self.lock:
+            nodes = self.__nodes(path)
+            return nodes[-1].directory if nodes else None
+
+    def ancestors(self, path: str) -> list[Directory]:
+
+        """Returns the registered directories above the passed path, nearest first."""
+
+        with self.lock:
+            self.build()
+            ancestors = []
+            node = self.root
+
+            for component in split(path)[:-1]:
+                node = node.children.get(component)
+                if node is None:
+                    break
+                if node.directory is not None:
+                    ancestors.append(node.directory)
+
+            ancestors.reverse()
+            return ancestors
+
+    def parent(self, path: str) -> Directory | None:
+
+        """Returns the nearest registered directory above the passed path."""
+
+        ancestors = self.ancestors(path)
+        return ancestors[0] if ancestors else None
+
+    def subtree(self, path: str) -> Iterator[Directory]:
+
+        """Yields the directory registered at the passed path, if any, and every registered directory below it."""
+
+        with self.lock:
+            nodes = self.__nodes(path)
+            if nodes is None:
+                return
+
+            stack = [nodes[-1]]
+            directories = []
+            while stack:
+                node = stack.pop()
+                if node.directory is not None:
+                    directories.append(node.directory)
+                stack.extend(node.children.values())
+
+        yield from directories
+
+    def roots(self) -> list[Directory]:
+
+        """Returns the registered directories that have no registered directory above them."""
+
+        with self.lock:
+            self.build()
+            roots = []
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                if node.directory is not None:
+                    roots.append(node.directory)
+                else:
+                    stack.extend(node.children.values())
+
+            return roots
+
+    def move(self, old_path: str, new_path: str) -> list[Directory]:
+
+        """
+        Moves everything registered at or below the old path to the new path in one operation, merging it with
+        anything already registered below the new path. Returns the moved directories, whose paths are not changed.
+        Raises FileExistsError if a directory is registered at the same position under both paths.
+        """
+
+        with self.lock:
+            self.build()
+            old_components = split(old_path)
+            nodes = self.__nodes(old_path)
+            if nodes is None:
+                return []
+
+            moved = nodes[-1]
+            self.__check_merge(self.__nodes(new_path), moved)
+
+            del nodes[-2].children[old_components[-1]]
+            self.__prune(nodes[:-1], old_components[:-1])
+
+            parent = self.root
+            new_components = split(new_path)
+            for component in new_components[:-1]:
+                parent = parent.children.setdefault(component, Node())
+
+            existing = parent.children.get(new_components[-1])
+            if existing is None:
+                parent.children[new_components[-1]] = moved
+            else:
+                self.__merge(existing, moved)
+
+            directories = []
+            stack = [moved]
+            while stack:
+                node = stack.pop()
+                if node.directory is not None:
+                    directories.append(node.directory)
+                stack.extend(node.children.values())
+
+            return directories
+
+    def populate(self, directories: Iterable[Directory]):
+
+        """Inserts the directories while the trie is being built."""
+
+        for directory in directories:
+            self.insert(directory.path, directory)
+
+    def __nodes(self, path: str) -> list[Node] | None:
+
+        """Returns the nodes from the root down to the passed path, or None if the path is not in the trie."""
+
+        self.build()
+        nodes = [self.root]
+        for component in split(path):
+            node = nodes[-1].children.get(component)
+            if node is None:
+                return None
+            nodes.append(node)
+
+        return nodes
+
+    def __check_merge(self, existing: list[Node] | None, moved: Node):
+
+        """Raises FileExistsError if merging the moved node into the existing one would replace a directory."""
+
+        if existing is None:
+            return
+
+        stack = [(existing[-1], moved)]
+        while stack:
+            destination, source = stack.pop()
+            if destination.directory is not None and source.directory is not None:
+                raise FileExistsError(f"The directory {destination.directory.path} is already registered.")
+
+            for component, child in source.children.items():
+                if component in destination.children:
+                    stack.append((destination.children[component], child))
+
+    def __merge(self, destination: Node, source: Node):
+
+        """Merges the source node into the destination node, which must not conflict."""
+
+        if source.directory is not None:
+            destination.directory = source.directory
+
+        for component, child in source.children.items():
+            if component in destination.children:
+                self.__merge(destination.children[component], child)
+            else:
+                destination.children[component] = child
+
+    @staticmethod
+    def __prune(nodes: list[Node], components: list[str]):
+
+        """Removes nodes along the path that no longer hold a directory or children, from the bottom up."""
+
+        for depth in range(len(nodes) - 1, 0, -1):
+            node = nodes[depth]
+            if node.directory is not None or node.children:
+                break
+            del nodes[depth - 1].children[components[depth - 1]]
+
+
+# Functions
+def split(path: str) -> list[str]:
+
+    """
+    Splits a path into its components, so that equivalent spellings of the same path are stored together. Relative
+    paths are resolved against the working directory, as file system events always carry absolute paths.
+    """
+
+    path = os.path.abspath(path)
+
+    if os.altsep:
+        path = path.replace(os.altsep, os.sep)
+
+    return path.split(os.sep)
@@ -0,0 +1,272 @@
+# Event coalescing and worker pool used to sort files outside of the observer thread
+__author__ = "Matteo Golin"
+
+# Imports
+import heapq
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .application import Application
+import utils as u
+import utils.metrics as metrics
+
+# Constants
+FIRST_CHECK = 0.25  # Seconds after an event before a file is first checked for changes
+MAX_PENDING = 10_000  # Paths that can wait to settle before events are dropped in favour of a rescan
+MAX_RESCAN_DELAY = 10.0  # Longest time in seconds a rescan waits for an event storm to end
+
+
+# Class
+class SortPipeline:
+
+    """
+    Receives file paths from the event handler and coalesces repeated events for the same path. A path is settled
+    once its size and modification time stayed unchanged for the whole quiet window since its first event or last
+    change, so that a writer pausing between chunks does not have its file moved mid-write. It is looked at a short
+    while after its first event and then at doubling intervals, up to the quiet window, so a change is noticed early
+    and restarts the wait. Placeholders of downloads still being written next to them are held. Settled paths are
+    handed to a bounded pool of sort workers.
+
+    At most max_pending paths are tracked. When an event storm exceeds that, every waiting path is dropped along with
+    the events that follow, and the watched directory is rescanned like the initial sort does once the storm is over.
+    """
+
+    def __init__(self, app: Application, quiet_window: float, workers: int, max_pending: int = MAX_PENDING):
+        self.app = app
+        self.quiet_window = quiet_window
+        self.workers = workers
+        self.max_pending = max_pending
+
+        self.pending = {}  # Path -> deadline of its next check
+        self.snapshots = {}  # Path -> size and modification time when it was last looked at
+        self.intervals = {}  # Path -> seconds between its last two looks
+        self.first_seen = {}  # Path -> time of the first event since the path was last sorted
+        self.changed_at = {}  # Path -> time of its first event or the last change seen since
+        self.deadlines = []  # Heap of (deadline, path), stale entries are skipped when popped
+        self.rescan_at = None  # Time of the rescan scheduled after an overflow, if any
+        self.overflowed_at = None  # Time of the overflow that scheduled the rescan
+        self.condition = threading.Condition()
+        self.running = False
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sorter")
+        self.slots = threading.BoundedSemaphore(workers)  # Paths handed to the pool but not yet sorted
+        self.dispatcher = threading.Thread(target=self.__dispatch, name="dispatcher", daemon=True)
+
+    # Methods
+    def start(self):
+
+        """Starts dispatching settled paths to the workers."""
+
+        self.running = True
+        self.dispatcher.start()
+
+    def stop(self):
+
+        """Stops dispatching and waits for the workers to finish the files they are sorting."""
+
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        self.dispatcher.join()
+        self.executor.shutdown(wait=True)
+
+    def submit(self, file_path: str):
+
+        """
+        Queues a path to be sorted, postponing it if an event for the same path is already waiting. Downloads that are
+        still in progress are skipped, as they are submitted again under their final name once renamed. While a rescan
+        is scheduled, events are dropped and postpone the rescan instead.
+        """
+
+        if u.in_progress(file_path):
+            return
+
+        snapshot = u.snapshot(file_path)
+
+        with self.condition:
+            now = time.monotonic()
+
+            if self.rescan_at is not None:
+                metrics.events_dropped.inc()
+                self.rescan_at = min(now + self.quiet_window, self.overflowed_at + MAX_RESCAN_DELAY)
+                return
+
+            if file_path not in self.pending and len(self.pending) >= self.max_pending:
+                self.__overflow(now)
+                return
+
+            if file_path in self.pending:
+                metrics.events_coalesced.inc()
+                changed = snapshot != self.snapshots[file_path]  # Files that keep changing are given longer to settle
+                interval = self.__backoff(file_path) if changed else self.intervals[file_path]
+                if changed:
+                    self.changed_at[file_path] = now
+            else:
+                interval = min(FIRST_CHECK, self.quiet_window)
+                self.changed_at[file_path] = now
+            self.first_seen.setdefault(file_path, now)
+
+            self.snapshots[file_path] = snapshot
+            self.__schedule(file_path, now + interval, interval)
+
+    def __schedule(self, file_path: str, deadline: float, interval: float):
+
+        """Schedules the next check of a path, replacing any earlier schedule. Must be called holding the condition."""
+
+        self.pending[file_path] = deadline
+        self.intervals[file_path] = interval
+        heapq.heappush(self.deadlines, (deadline, file_path))
+
+        # Drop stale entries once they outnumber the live ones, so the heap stays proportional to the waiting paths
+        if len(self.deadlines) > 2 * len(self.pending) + 64:
+            self.deadlines = [(deadline, path) for path, deadline in self.pending.items()]
+            heapq.heapify(self.deadlines)
+
+        self.condition.notify()
+
+    def __overflow(self, now: float):
+
+        """Drops every waiting path and schedules a rescan instead. Must be called holding the condition."""
+
+        metrics.overflows.inc()
+        metrics.events_dropped.inc(len(self.pending) + 1)
+        print(f"More than {self.max_pending} files are waiting to be sorted, rescanning once events calm down.")
+
+        self.pending.clear()
+        self.snapshots.clear()
+        self.intervals.clear()
+        self.first_seen.clear()
+        self.changed_at.clear()
+        self.deadlines = []
+
+        self.overflowed_at = now
+        self.rescan_at = now + self.quiet_window
+        self.condition.notify()
+
+    def __backoff(self, file_path: str) -> float:
+
+        """Returns the interval before the next check of a path that was still changing, doubled up to the window."""
+
+        return min(self.intervals[file_path] * 2, self.quiet_window)
+
+    def __forget(self, file_path: str) -> float:
+
+        """Stops tracking a path and returns the time of its first event. Must be called holding the condition."""
+
+        del self.pending[file_path]
+        del self.snapshots[file_path]
+        del self.intervals[file_path]
+        del self.changed_at[file_path]
+        return self.first_seen.pop(file_path)
+
+    def __settled(self, file_path: str, snapshot: tuple[int, int], now: float) -> bool:
+
+        """
+        Returns True if a path has settled: it is unchanged since it was last looked at, it stayed unchanged for the
+        whole quiet window, and no download is still being written next to it.
+        """
+
+        if snapshot != self.snapshots[file_path]:
+            return False
+
+        if now - self.changed_at[file_path] < self.quiet_window:
+            return False
+
+        return not u.placeholder(file_path)
+
+    def __next_settled(self) -> tuple[str | None, float] | None:
+
+        """
+        Blocks until a path has settled and returns it with the time of its first event, or None once stopped. Paths
+        that disappeared are dropped, and paths that changed since they were last looked at are checked again later.
+        A due rescan is returned as a path of None, along with the time of the overflow.
+        """
+
+        with self.condition:
+            while self.running:
+                now = time.monotonic()
+                next_check = self.deadlines[0][0] if self.deadlines else math.inf
+                next_rescan = math.inf if self.rescan_at is None else self.rescan_at
+
+                if next_rescan <= now:
+                    self.rescan_at = None
+                    return None, self.overflowed_at
+
+                if next_check > now:
+                    upcoming = min(next_check, next_rescan)
+                    self.condition.wait(None if upcoming == math.inf else upcoming - now)
+                    continue
+
+                deadline, file_path = heapq.heappop(self.deadlines)
+                if self.pending.get(file_path) != deadline:  # A newer event rescheduled the path
+                    continue
+
+                snapshot = u.snapshot(file_path)
+                if snapshot is None:  # Moved or deleted before it settled
+                    self.__forget(file_path)
+                    continue
+
+                if self.__settled(file_path, snapshot, now):
+                    return file_path, self.__forget(file_path)
+
+                if snapshot != self.snapshots[file_path]:
+                    self.changed_at[file_path] = now
+
+                # Looked at again as soon as the quiet window is over, unless a download next to it holds it longer
+                interval = self.__backoff(file_path)
+                deadline = now + interval
+                quiet_at = self.changed_at[file_path] + self.quiet_window
+                if now < quiet_at < deadline:
+                    deadline = quiet_at
+
+                self.snapshots[file_path] = snapshot
+                self.__schedule(file_path, deadline, interval)
+
+        return None
+
+    def __dispatch(self):
+
+        """Hands settled paths to the worker pool, waiting for a free worker when all of them are busy."""
+
+        while True:
+            settled = self.__next_settled()
+            if settled is None:
+                return
+
+            file_path, first_seen = settled
+
+            self.slots.acquire()
+            if file_path is None:
+                future = self.executor.submit(self.__rescan)
+            else:
+                future = self.executor.submit(self.__sort, file_path, first_seen)
+            future.add_done_callback(lambda _: self.slots.release())
+
+    def __sort(self, file_path: str, first_seen: float):
+
+        """Sorts a settled path, unless it has already been moved or deleted."""
+
+        if os.path.isfile(file_path):
+            try:
+                if self.app.sort_file(file_path) is not None:
+                    metrics.event_latency.observe(time.monotonic() - first_seen)
+            except OSError as error:
+                metrics.errors.inc()
+                print(f"Could not sort {file_path}: {error}")
+
+    def __rescan(self):
+
+        """
+        Sorts the whole watched directory after an overflow, picking up the files whose events were dropped. Only files
+        that stay unchanged over the quiet window are sorted, as the files still being written are submitted again by
+        their next events.
+        """
+
+        try:
+            self.app.sort_directory(self.app.config.watch_dir, workers=self.workers, settle=self.quiet_window)
+        except OSError as error:
+            metrics.errors.inc()
+            print(f"Could not rescan {self.app.config.watch_dir}: {error}")
@@ -0,0 +1,264 @@
+# Crash-safe persistence of the configurations as a JSON snapshot and an append-only journal of changes
+__author__ = "Matteo Golin"
+
+# Imports
+import json
+import marshal
+import os
+import re
+import sys
+
+# Constants
+JOURNAL_SUFFIX = ".journal"
+CACHE_SUFFIX = ".cache"
+CACHE_VERSION = 3  # Increased whenever the layout of the cached data changes
+COMPACT_MIN_SIZE = 1024 * 1024  # The journal is never compacted before it reaches this many bytes
+GENERATION = re.compile(rb'\{"generation": (\d+)')  # Start of a snapshot or of the first line of a journal
+
+
+# Class
+class Storage:
+
+    """
+    Stores the configurations in a JSON snapshot, with every change since the snapshot appended to a journal file.
+    Saving only writes the changed records, and the journal is folded back into the snapshot once it grows larger
+    than the snapshot itself. The snapshot is always replaced atomically, so a crash can never truncate it. Every
+    snapshot has a generation, which the journal names in its first line, so a journal left behind by a crash during
+    compaction is recognized as older than the snapshot and ignored.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.journal = f"{filename}{JOURNAL_SUFFIX}"
+        self.cache = f"{filename}{CACHE_SUFFIX}"
+
+    # Methods
+    def exists(self) -> bool:
+
+        """Returns True if a snapshot has been saved."""
+
+        return os.path.exists(self.filename)
+
+    def load(self) -> dict:
+
+        """
+        Returns the snapshot with all journaled changes applied to it. Directories are returned as columns: a list of
+        the directory paths and a dict of field name -> values in the same order as the paths, so that they can be
+        restored without creating a dict per directory. The result is cached in a marshal file next to the snapshot,
+        which is used instead for as long as the snapshot and journal are unchanged.
+        """
+
+        key = self.__cache_key()
+        data = self.__load_cache(key)
+
+        if data is None:
+            data = self.__load_json()
+            data["directories"] = self.__to_columns(data["directories"])
+
+            # Only cache the data if no other process changed the files while they were being read
+            if self.__cache_key() == key:
+                self.__save_cache(key, data)
+
+        return data
+
+    def __load_json(self) -> dict:
+
+        """
+        Parses the snapshot and replays the journal on top of it. Directory paths are made absolute, as older versions
+        saved them as they were typed.
+        """
+
+        with open(self.filename, "r") as snapshot:
+            data = json.load(snapshot)
+        generation = data.pop("generation", 0)
+        data["directories"] = {
+            os.path.abspath(path): directory for path, directory in data.get("directories", {}).items()
+        }
+
+        if not os.path.exists(self.journal):
+            return data
+
+        with open(self.journal, "rb") as journal:
+            lines = journal.read().split(b"\n")
+
+        if self.__journal_generation(lines[0]) != generation:  # Already folded into the snapshot
+            return data
+
+        # A final line without a newline is still being written, or was torn by a crash, so it is skipped
+        for line in lines[:-1]:
+            try:
+                record = json.loads(line)
+            except ValueError:  # A torn line that a later append was written after
+                continue
+            self.__apply(data, record)
+
+        return data
+
+    def __cache_key(self) -> tuple:
+
+        """Returns the modification times and sizes of the snapshot and journal, which validate the cache."""
+
+        key = (CACHE_VERSION,)
+        for filename in (self.filename, self.journal):
+            try:
+                stat = os.stat(filename)
+                key += (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                key += (None, None)
+
+        return key
+
+    def __load_cache(self, key: tuple) -> dict | None:
+
+        """Returns the cached data, or None if there is no cache or it is out of date."""
+
+        try:
+            with open(self.cache, "rb") as cache:
+                cached_key, data = marshal.loads(cache.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+        if cached_key != key:
+            return None
+
+        return data
+
+    def __save_cache(self, key: tuple, data: dict):
+
+        """
+        Caches the loaded data with marshal, which reads the columns back much faster than JSON. Unlike pickle, marshal
+        only ever creates plain values, so a cache file planted in the working directory cannot run any code.
+        """
+
+        temporary = f"{self.cache}.tmp"
+
+        try:
+            with open(temporary, "wb") as cache:
+                cache.write(marshal.dumps((key, data)))
+            os.replace(temporary, self.cache)
+        except (OSError, ValueError):  # The cache is only an optimization
+            pass
+
+    def append(self, records: list[dict]):
+
+        """Durably appends change records to the journal."""
+
+        if not records:
+            return
+
+        lines = "".join(f"{json.dumps(record)}\n" for record in records)
+        generation = self.__snapshot_generation()
+
+        with open(self.journal, "ab+") as journal:
+            journal.seek(0)
+            first_line = journal.readline()
+
+            if not first_line or self.__journal_generation(first_line) != generation:
+                # A new journal, or one left behind by a compaction, is started over for the current snapshot
+                journal.truncate(0)
+                lines = f"{json.dumps({'generation': generation, 'op': 'generation'})}\n{lines}"
+            else:
+                journal.seek(-1, os.SEEK_END)
+                if journal.read(1) != b"\n":  # The last append was torn by a crash
+                    lines = f"\n{lines}"
+
+            journal.write(lines.encode())
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def compact(self, data: dict, default=None):
+
+        """
+        Atomically replaces the snapshot with the passed data and clears the journal. The snapshot gets the next
+        generation, so the old journal is ignored even if a crash keeps it from being removed.
+        """
+
+        temporary = f"{self.filename}.tmp"
+        data = {"generation": self.__snapshot_generation() + 1, **data}  # First, so that it can be read cheaply
+
+        with open(temporary, "w") as snapshot:
+            json.dump(data, snapshot, default=default)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+
+        os.replace(temporary, self.filename)
+
+        if os.path.exists(self.journal):
+            os.remove(self.journal)
+
+    def should_compact(self) -> bool:
+
+        """Returns True once the journal is larger than the snapshot it applies to."""
+
+        try:
+            journal_size = os.path.getsize(self.journal)
+        except FileNotFoundError:
+            return False
+
+        return journal_size > max(COMPACT_MIN_SIZE, os.path.getsize(self.filename))
+
+    def __snapshot_generation(self) -> int:
+
+        """Returns the generation of the snapshot, read from its start. Snapshots without one are generation 0."""
+
+        try:
+            with open(self.filename, "rb") as snapshot:
+                match = GENERATION.match(snapshot.read(64))
+        except FileNotFoundError:
+            return 0
+
+        return int(match.group(1)) if match else 0
+
+    # Static methods
+    @staticmethod
+    def __journal_generation(first_line: bytes) -> int:
+
+        """Returns the generation of the snapshot a journal applies to, from its first line. Older journals are 0."""
+
+        match = GENERATION.match(first_line)
+        return int(match.group(1)) if match else 0
+
+    @staticmethod
+    def __to_columns(directories: dict) -> tuple[list[str], dict[str, list]]:
+
+        """
+        Converts the directories from JSON objects to columns. Lists become frozen sets of interned strings, and equal
+        sets are shared, so that repeated tags are stored once in memory and in the cache.
+        """
+
+        paths = list(directories)
+        representations = directories.values()
+        fields = {field for representation in representations for field in representation}
+        shared = {}
+
+        def freeze(value):
+            if not isinstance(value, list):
+                return value
+
+            items = frozenset(map(sys.intern, value))
+            return shared.setdefault(items, items)
+
+        columns = {}
+        for field in fields:
+            columns[field] = [freeze(representation.get(field)) for representation in representations]
+
+        return paths, columns
+
+    @staticmethod
+    def __apply(data: dict, record: dict):
+
+        """Applies a single journal record to the loaded data."""
+
+        operation = record.pop("op")
+
+        if operation == "generation":
+            return
+
+        if operation == "settings":
+            data.update(record)
+
+        elif operation == "directory":
+            data["directories"][os.path.abspath(record.pop("path"))] = record
+
+        elif operation == "remove":
+            data["directories"].pop(os.path.abspath(record["path"]), None)
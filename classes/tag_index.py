@@ -0,0 +1,340 @@
+from __future__ import annotations
+
+# Multi-pattern tag matcher for scoring every directory against a filename in one pass
+__author__ = "Matteo Golin"
+
+# Imports
+import heapq
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Iterable, NamedTuple
+from .lazy_index import LazyIndex
+import utils.metrics as metrics
+
+if TYPE_CHECKING:
+    from .directory import Directory
+
+# Constants
+CACHE_SIZE = 4096  # Routing decisions remembered for the most recently seen tag signatures
+
+# Types
+Match = tuple["Directory | None", int]
+Ranking = tuple[Match, Match]  # The best match and the runner-up
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    size: int
+    max_size: int
+
+
+# Class
+class TagIndex(LazyIndex):
+
+    """
+    Aho-Corasick automaton built from the tags of all directories. A filename is scanned once, producing the set of
+    distinct tags it contains, which is then used to score only the directories that own at least one of those tags,
+    or inherit it from a directory owning it as a recursive tag. Directories are scored on their effective tags.
+    Files with the same set of tags always go to the same directory, so decisions are remembered per set of tags until
+    any tag changes. Built the first time a file is matched.
+    """
+
+    def __init__(self, source: Callable[[], Iterable[Directory]], cache_size: int = CACHE_SIZE):
+        super(TagIndex, self).__init__(source)
+        self.owners = {}  # Tag -> directories with the tag as an own or recursive tag (dict used as an ordered set)
+        self.order = {}  # Directory path -> registration number, used to break ties like the old linear scan
+        self.lock = threading.RLock()
+
+        # Routing decisions, least recently used first
+        self.cache = OrderedDict()  # Frozen set of tags -> ranking
+        self.cache_size = cache_size
+        self.version = 0  # Increased whenever the cache is cleared, so that rankings computed before are not cached
+        self.hits = 0
+        self.misses = 0
+
+        # Automaton
+        self.__goto = [{}]
+        self.__fail = [0]
+        self.__output = [()]
+        self.__links_stale = False  # New tags were inserted since failure links were computed
+        self.__trie_stale = False  # Tags were removed, so the trie holds dead patterns
+
+    # Methods
+    def register(self, directory: Directory):
+
+        """Records the order in which a directory path was first registered."""
+
+        with self.lock:
+            self.order.setdefault(directory.path, len(self.order))
+
+    def register_all(self, paths: Iterable[str]):
+
+        """Records the order of directory paths registered in bulk."""
+
+        with self.lock:
+            order = self.order
+            for path in paths:
+                order.setdefault(path, len(order))
+
+    def rename(self, old_path: str, new_path: str):
+
+        """Keeps the registration order of a directory whose path changed."""
+
+        with self.lock:
+            if old_path in self.order:
+                self.order[new_path] = self.order.pop(old_path)
+
+    def add(self, directory: Directory, tag: str):
+
+        """Adds a tag owned by the passed directory."""
+
+        with self.lock:
+            self.invalidate()
+            if not self.built:  # The tag will be read from the source when the index is built
+                return
+
+            owners = self.owners.get(tag)
+
+            if owners is None:
+                self.owners[tag] = {directory: None}
+                self.__insert(tag)
+            else:
+                owners[directory] = None
+
+    def add_all(self, directories: list[Directory]):
+
+        """Registers the passed directories and all of their tags in bulk."""
+
+        with self.lock:
+            self.invalidate()
+            self.register_all(directory.path for directory in directories)
+            if not self.built:
+                return
+
+            owners = self.owners
+            for directory in directories:
+                for tag in (*directory.tags, *directory.recursive_tags):
+                    tag_owners = owners.get(tag)
+                    if tag_owners is None:
+                        owners[tag] = {directory: None}
+                        self.__insert(tag)
+                    else:
+                        tag_owners[directory] = None
+
+    def remove(self, directory: Directory, tag: str):
+
+        """Removes a tag from the passed directory, dropping the pattern if no other directory owns it."""
+
+        with self.lock:
+            owners = self.owners.get(tag)
+            if owners is None:
+                return
+
+            self.invalidate()
+            owners.pop(directory, None)
+            if not owners:
+                del self.owners[tag]
+                self.__trie_stale = True
+
+    def discard(self, directory: Directory):
+
+        """Removes all tags owned by the passed directory."""
+
+        with self.lock:
+            for tag in directory.tags | directory.recursive_tags:
+                self.remove(directory, tag)
+
+    def invalidate(self):
+
+        """Forgets the remembered routing decisions, as the tags they were based on changed."""
+
+        with self.lock:
+            self.cache.clear()
+            self.version += 1
+
+    def find_tags(self, text: str) -> set[str]:
+
+        """Returns the set of distinct tags contained in the passed text, using a single pass over the text."""
+
+        with self.lock:
+            self.build()
+            self.__refresh()
+            goto, fail, output = self.__goto, self.__fail, self.__output
+
+            found = set(output[0])
+            state = 0
+
+            for char in text.lower():
+                while state and char not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(char, 0)
+                found.update(output[state])
+
+            return found
+
+    def score(self, tags: frozenset[str]) -> dict[Directory, int]:
+
+        """
+        Returns the number of matching effective tags for every directory owning or inheriting at least one of the
+        passed tags. The directories inheriting a tag are listed outside of the lock, as the directory tree has a lock
+        of its own.
+        """
+
+        candidates = {}
+        recursive_owners = {}
+
+        with self.lock:
+            self.build()
+            for tag in tags:
+                for directory in self.owners.get(tag, ()):
+                    if tag in directory.recursive_tags:
+                        recursive_owners[directory] = None
+                    else:
+                        candidates[directory] = None
+
+        for directory in recursive_owners:
+            candidates.update(dict.fromkeys(directory.inheritors()))
+
+        return {directory: len(directory.effective_tags() & tags) for directory in candidates}
+
+    def best_match(self, filename: str, content: str = "") -> Match:
+
+        """
+        Returns the directory with the most matching tags and its score. Tags are looked for in the filename and in
+        the optional description of the file's content, and count once even if found in both. Ties are won by the
+        directory registered first. If no tag matches, (None, 0) is returned.
+        """
+
+        return self.rank(filename, content)[0]
+
+    def rank(self, filename: str, content: str = "") -> Ranking:
+
+        """
+        Returns the best match for the file, as best_match does, followed by the runner-up. A runner-up with the same
+        score as the best match lost a tie. Missing matches are (None, 0).
+        """
+
+        with self.lock:
+            tags = self.find_tags(filename)
+            if content:
+                tags |= self.find_tags(content)
+            signature = frozenset(tags)
+
+            ranking = self.cache.get(signature)
+            if ranking is not None:
+                self.cache.move_to_end(signature)
+                self.hits += 1
+                metrics.route_cache_hits.inc()
+                return ranking
+
+            self.misses += 1
+            metrics.route_cache_misses.inc()
+            version = self.version
+
+        scores = self.score(signature)
+
+        with self.lock:
+            ranking = self.__top_two(scores)
+
+            # Tags may have changed while the directories were scored, in which case the ranking is not remembered
+            if self.version == version:
+                self.cache[signature] = ranking
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+            return ranking
+
+    def cache_info(self) -> CacheInfo:
+
+        """Returns the hits, misses and current size of the routing cache."""
+
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, len(self.cache), self.cache_size)
+
+    def __top_two(self, scores: dict[Directory, int]) -> Ranking:
+
+        """Returns the two directories with the highest scores, breaking ties by registration order."""
+
+        order = self.order
+        top = heapq.nlargest(2, scores, key=lambda d: (scores[d], -order.get(d.path, len(order))))
+        matches = [(directory, scores[directory]) for directory in top] + [(None, 0)] * (2 - len(top))
+        return matches[0], matches[1]
+
+    def populate(self, directories: Iterable[Directory]):
+
+        """Registers the tags of the directories while the index is being built."""
+
+        self.add_all(list(directories))
+
+    def __insert(self, tag: str):
+
+        """Inserts a new pattern into the trie. Failure links are recomputed lazily before the next search."""
+
+        goto = self.__goto
+        state = 0
+
+        for char in tag:
+            next_state = goto[state].get(char)
+            if next_state is None:
+                next_state = len(goto)
+                goto[state][char] = next_state
+                goto.append({})
+            state = next_state
+
+        self.__links_stale = True
+
+    def __refresh(self):
+
+        """Rebuilds the trie and/or failure links if tags changed since the last search."""
+
+        if self.__trie_stale:
+            self.__goto = [{}]
+            for tag in self.owners:
+                self.__insert(tag)
+            self.__trie_stale = False
+            self.__links_stale = True
+
+        if self.__links_stale:
+            self.__build_links()
+            self.__links_stale = False
+
+    def __build_links(self):
+
+        """Computes failure links and outputs with a breadth first traversal of the trie."""
+
+        goto = self.__goto
+        fail = [0] * len(goto)
+        output = [()] * len(goto)
+
+        # Outputs are stored per node, so patterns are located by walking the trie once per tag
+        ends = {}
+        for tag in self.owners:
+            state = 0
+            for char in tag:
+                state = goto[state][char]
+            ends[state] = (tag,)
+
+        output[0] = ends.get(0, ())
+        queue = list(goto[0].values())
+
+        for state in queue:
+            output[state] = ends.get(state, ()) + output[0]  # Children of the root fail back to the root
+
+        index = 0
+        while index < len(queue):
+            state = queue[index]
+            index += 1
+
+            for char, child in goto[state].items():
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                child_fail = goto[fallback].get(char, 0)
+
+                fail[child] = child_fail
+                output[child] = ends.get(child, ()) + output[child_fail]
+                queue.append(child)
+
+        self.__fail = fail
+        self.__output = output
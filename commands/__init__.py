@@ -4,6 +4,7 @@ __author__ = "Matteo Golin"
 # Imports
 import argparse
 import commands.validators as v
+from utils import DEDUPE_MODES
 
 # Constants
 HELP_STATEMENTS = {
@@ -15,6 +16,13 @@ HELP_STATEMENTS = {
     "console": "Starts the console interface at runtime.",
     "config": "Creates a new configurations file. This overwrites any existing configurations.",
     "mod-config": "Allows modification of the configurations file.",
+    "plan": "Scores the watched directory, or another directory, and writes where each file would be sorted to a plan "
+            "file without moving anything.",
+    "apply-plan": "Moves files to the targets of a previously written plan file.",
+    "undo": "Moves the files sorted in a batch and/or time range back to where they came from. Lists the sorted "
+            "batches if neither is given.",
+    "audit": "Scores the files already in the added directories again, and reports or moves the files that another "
+             "directory now has more matching tags for.",
 }
 
 # Parsers
@@ -22,6 +30,16 @@ parser = argparse.ArgumentParser(description=HELP_STATEMENTS["parser"])
 subparsers = parser.add_subparsers(dest="subcommand", help=HELP_STATEMENTS["subcommands"])
 
 # Main commands
+parser.add_argument(
+    "-metrics-file", "-mf",
+    help="Periodically writes the sorter's metrics to this file in the Prometheus text format.",
+)
+
+parser.add_argument(
+    "-metrics-port", "-mp",
+    help="Serves the sorter's metrics in the Prometheus text format on this port of localhost.",
+    type=v.PositiveInt,
+)
 
 # Sub commands
 
@@ -31,6 +49,73 @@ console_options = subparsers.add_parser("console", help=HELP_STATEMENTS["console
 # Initial sort
 initial_sort = subparsers.add_parser("initial-sort", help=HELP_STATEMENTS["initial-sort"])
 
+initial_sort.add_argument(
+    "-workers", "-wk",
+    help="Number of files moved at the same time during the initial sort. Defaults to the configured workers.",
+    type=v.PositiveInt,
+)
+
+# Plan
+plan = subparsers.add_parser("plan", help=HELP_STATEMENTS["plan"])
+
+plan.add_argument(
+    "directory",
+    nargs="?",
+    help="Directory whose files are planned. Defaults to the watched directory.",
+    type=v.Directory,
+)
+
+plan.add_argument(
+    "-output", "-o",
+    default="plan.jsonl",
+    help="File the plan is written to.",
+)
+
+# Apply plan
+apply_plan = subparsers.add_parser("apply-plan", help=HELP_STATEMENTS["apply-plan"])
+
+apply_plan.add_argument(
+    "plan-file",
+    nargs="?",
+    default="plan.jsonl",
+    help="Plan file written by the plan subcommand.",
+)
+
+apply_plan.add_argument(
+    "-workers", "-wk",
+    help="Number of files moved at the same time. Defaults to the configured workers.",
+    type=v.PositiveInt,
+)
+
+# Audit
+audit = subparsers.add_parser("audit", help=HELP_STATEMENTS["audit"])
+
+audit.add_argument(
+    "-output", "-o",
+    default="audit.jsonl",
+    help="File the misfiled files are reported to.",
+)
+
+audit.add_argument(
+    "-move", "-mv",
+    default=False,
+    help="Moves the misfiled files to the directories they now belong in.",
+    action="store_true",
+)
+
+audit.add_argument(
+    "-workers", "-wk",
+    help="Number of processes scoring files. Defaults to the number of CPUs.",
+    type=v.PositiveInt,
+)
+
+audit.add_argument(
+    "-restart", "-r",
+    default=False,
+    help="Starts the audit over instead of resuming an interrupted one.",
+    action="store_true",
+)
+
 # Create config commands
 set_config = subparsers.add_parser("config", help=HELP_STATEMENTS["config"])
 
@@ -73,6 +158,37 @@ modify_config.add_argument(
     nargs="*",
 )
 
+modify_config.add_argument(
+    "-quiet-window", "-qw",
+    help="Resets the number of seconds a file must stay unchanged before it is sorted.",
+    type=v.PositiveSeconds,
+)
+
+modify_config.add_argument(
+    "-workers", "-wk",
+    help="Resets the number of files that can be sorted at the same time.",
+    type=v.PositiveInt,
+)
+
+modify_config.add_argument(
+    "-classify", "-cl",
+    help="Turns on or off reading the start of files to find more matching tags in their type and metadata.",
+    type=v.Toggle,
+)
+
+modify_config.add_argument(
+    "-dedupe", "-dd",
+    help="Sets what is done with files identical to a file already in their directory: nothing (off), leave them in "
+         "place (skip), nest them as hard links to the identical file (link) or delete them (discard).",
+    choices=DEDUPE_MODES,
+)
+
+modify_config.add_argument(
+    "-verify-copies", "-vc",
+    help="Turns on or off checking files copied to another drive against the original before it is removed.",
+    type=v.Toggle,
+)
+
 # Add directory
 add_directory = subparsers.add_parser("add-directory", help=HELP_STATEMENTS["add-directory"])
 
@@ -102,3 +218,23 @@ add_directory.add_argument(
     help="Adds tags from the parent directory to the directory.",
     action="store_true",
 )
+
+# Undo
+undo = subparsers.add_parser("undo", help=HELP_STATEMENTS["undo"])
+
+undo.add_argument(
+    "-batch", "-b",
+    help="Name of the batch to undo, as printed by the initial sort or listed by this subcommand.",
+)
+
+undo.add_argument(
+    "-since", "-s",
+    help="Only undoes moves made at or after this time, such as 2026-10-18T09:30.",
+    type=v.Timestamp,
+)
+
+undo.add_argument(
+    "-until", "-u",
+    help="Only undoes moves made at or before this time, such as 2026-10-18T10:00.",
+    type=v.Timestamp,
+)
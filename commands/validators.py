@@ -3,6 +3,7 @@ __author__ = "Matteo Golin"
 
 # Imports
 import os
+from datetime import datetime
 
 # Constants
 
@@ -27,3 +28,54 @@ def Char(character: str) -> str:
 
     else:
         raise ValueError("The ignore character must only be one character long.")
+
+
+def Toggle(value: str) -> bool:
+
+    """Converts on/off style input to a boolean."""
+
+    if value.lower() in ["on", "yes", "y", "true"]:
+        return True
+
+    elif value.lower() in ["off", "no", "n", "false"]:
+        return False
+
+    else:
+        raise ValueError("The value must be on or off.")
+
+
+def PositiveInt(number: str) -> int:
+
+    """Ensure that the number is a whole number greater than zero."""
+
+    number = int(number)
+
+    if number > 0:
+        return number
+
+    else:
+        raise ValueError("The number must be greater than zero.")
+
+
+def PositiveSeconds(seconds: str) -> float:
+
+    """Ensure that the duration is a number of seconds greater than zero."""
+
+    seconds = float(seconds)
+
+    if seconds > 0:
+        return seconds
+
+    else:
+        raise ValueError("The duration must be greater than zero.")
+
+
+def Timestamp(moment: str) -> float:
+
+    """Converts a local date and time in ISO format to a timestamp."""
+
+    try:
+        return datetime.fromisoformat(moment).timestamp()
+
+    except ValueError:
+        raise ValueError("The time must be in ISO format, such as 2026-10-18T09:30.")
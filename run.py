@@ -2,21 +2,18 @@
 __author__ = "Matteo Golin"
 
 # Imports
-from classes.application import Application
-from classes.config import Config
-from classes.console import Console
-from classes.directory import Directory
-from classes.handler import WatchDir
 from commands import parser
 
-# Get arguments
-arguments = parser.parse_args()
-arguments = vars(arguments)  # Convert to dictionary
-subcommand = arguments.get("subcommand")
 
-print(f"DEBUG: {arguments}")
+# Functions, each importing only the modules its subcommand uses so that quick subcommands start quickly
+def create_config(arguments: dict):
+
+    """Creates a new configurations file."""
+
+    exit_if_sorting("replacing its configurations")
+
+    from classes.config import Config
 
-if subcommand == "config":
     config = Config(
         watch_dir=arguments.get("watch-dir"),
         ignore_char=arguments.get("ignore-char"),
@@ -25,48 +22,180 @@ if subcommand == "config":
     config.save({})
     print("Config file successfully created.\n")
     print(config)
-    quit()
 
-app = Application()
 
-if subcommand == "add-directory":
+def add_directory(arguments: dict):
 
-    # Unpack args
-    path = arguments.get("path")
-    tags = arguments.get("tags")
-    recursive = arguments.get("recursive_tags")
-    parent_tags = arguments.get("parent_tags")
+    """Adds a directory, or tags to an added directory."""
 
-    # Check if directory exists before creating a new one
-    directory = Directory.directories.get(path)
+    if send_to_sorter(arguments):
+        return
 
-    if directory:
-        directory.add_tags(tags, recursive)
-        if parent_tags:
-            directory.add_parent_tags(recursive)
-    else:
-        directory = Directory(
-            path=path,
-            tags=tags,
-            recursive=recursive,
-            parent_tags=parent_tags
-        )
+    from classes.application import Application
+
+    app = Application()
+    recursive = arguments.get("recursive_tags")
+    directory = app.add_directory(
+        arguments.get("path"), arguments.get("tags"), recursive=recursive, parent_tags=arguments.get("parent_tags")
+    )
 
     print(f"Director{'ies' if recursive else 'y'} successfully added.\n")
     print(directory)
     app.clean_up()
-    quit()
 
-if subcommand == "mod-config":
-    app.update_config(arguments)
+
+def modify_config(arguments: dict):
+
+    """Modifies the settings of the configurations file."""
+
+    if send_to_sorter(arguments):
+        return
+
+    from classes.config import Config
+
+    config, _ = Config.load()  # The directories are not restored, as only the settings change
+    config.update(arguments)
+    config.save_settings()
     print("Config successfully modified.\n")
-    print(app.config)
+    print(config)
+
+
+def plan(arguments: dict):
+
+    """Writes where the files of a directory would be sorted to a plan file."""
+
+    from classes.application import Application
+
+    app = Application()
+    app.plan(arguments.get("directory") or app.config.watch_dir, arguments.get("output"))
+
+
+def apply_plan(arguments: dict):
+
+    """Moves files to the targets of a plan file."""
+
+    exit_if_sorting("moving files")
+
+    from classes.application import Application
+
+    app = Application()
+    app.apply_plan(arguments.get("plan-file"), workers=arguments.get("workers") or app.config.workers)
+    app.clean_up()
+
+
+def undo(arguments: dict):
+
+    """Undoes journaled moves, or lists the journaled batches if none were selected."""
+
+    import time
+    from classes.application import Application
+
+    app = Application()
+    batch = arguments.get("batch")
+    since = arguments.get("since")
+    until = arguments.get("until")
+
+    if batch is None and since is None and until is None:
+        for name, count, first, last in app.batches():
+            print(f"{name}: {count} files moved between {time.ctime(first)} and {time.ctime(last)}")
+    else:
+        exit_if_sorting("undoing moves")
+        app.undo(batch=batch, since=since, until=until)
+
+    app.clean_up()
+
+
+def audit(arguments: dict):
+
+    """Reports, and optionally moves, the files in the added directories that now belong in another directory."""
+
+    if arguments.get("move"):
+        exit_if_sorting("moving files")
+
+    from classes.application import Application
+
+    app = Application()
+    app.audit(
+        arguments.get("output"),
+        workers=arguments.get("workers"),
+        move=arguments.get("move"),
+        restart=arguments.get("restart"),
+    )
+    app.clean_up()
+
+
+def watch(arguments: dict):
+
+    """Runs the sorter, after the initial sort or console if one of them was selected."""
+
+    exit_if_sorting("starting another one")
+
+    from classes.application import Application
+    from classes.handler import WatchDir
+
+    app = Application()
+    subcommand = arguments.get("subcommand")
+
+    if subcommand == "console":
+        from classes.console import Console
+
+        console = Console(app)
+        console.start()
+
+    watcher = WatchDir(app, metrics_file=arguments.get("metrics_file"), metrics_port=arguments.get("metrics_port"))
+    watcher.run(initial_sort=(subcommand == "initial-sort"), workers=arguments.get("workers"))
+
+
+def exit_if_sorting(action: str):
+
+    """
+    Exits if a sorter is running, as it must remain the only process changing the configurations, the journal of
+    moves and the indexes while it runs.
+    """
+
+    from classes.control import running
+
+    if running():
+        print(f"The sorter is already running. Stop it before {action}.")
+        quit(1)
+
+
+def send_to_sorter(arguments: dict) -> bool:
+
+    """
+    Sends the subcommand to the running sorter, which holds the configurations loaded and is their only writer, and
+    prints its answer. Returns False if no sorter is running, in which case the subcommand has to be run here.
+    """
+
+    from classes.control import send_request
+
+    response = send_request(arguments.get("subcommand"), arguments)
+    if response is None:
+        return False
+
+    print(response["output"])
+    if not response["ok"]:
+        quit(1)
+
+    return True
+
+
+# Subcommand -> function running it, the sorter runs when there is no subcommand
+SUBCOMMANDS = {
+    "config": create_config,
+    "add-directory": add_directory,
+    "mod-config": modify_config,
+    "plan": plan,
+    "apply-plan": apply_plan,
+    "undo": undo,
+    "audit": audit,
+}
 
-if subcommand == "console":
-    console = Console(app)
-    console.start()
 
-# File save event logic
 if __name__ == "__main__":
-    watcher = WatchDir(app)
-    watcher.run(initial_sort=(subcommand == "initial-sort"))
+    arguments = parser.parse_args()
+    arguments = vars(arguments)  # Convert to dictionary
+
+    print(f"DEBUG: {arguments}")
+
+    SUBCOMMANDS.get(arguments.get("subcommand"), watch)(arguments)
@@ -0,0 +1,42 @@
+# Tests of auditing the files in the added directories
+__author__ = "Matteo Golin"
+
+# Imports
+import contextlib
+import io
+import sqlite3
+import unittest
+from unittest import mock
+import classes.application as application
+
+
+# Classes
+class LockedAuditor:
+
+    """Stands in for the application of an audit worker, whose classifier cache is locked for one of the files."""
+
+    def audit_file(self, file_path: str, current_path: str) -> dict:
+        if file_path == "locked.pdf":
+            raise sqlite3.OperationalError("database is locked")
+
+        return {"source": file_path, "current": current_path}
+
+
+class TestAuditFiles(unittest.TestCase):
+
+    def test_database_error_only_skips_its_file(self):
+        output = io.StringIO()
+
+        with (
+            mock.patch.object(application, "auditor", LockedAuditor(), create=True),
+            contextlib.redirect_stdout(output),
+        ):
+            audited, entries = application.audit_files([("locked.pdf", "inbox", 0), ("report.pdf", "inbox", 1)])
+
+        self.assertEqual(audited, 2)
+        self.assertEqual(entries, [(1, {"source": "report.pdf", "current": "inbox"})])
+        self.assertIn("locked.pdf", output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+# Tests of how moves are journaled and undone
+__author__ = "Matteo Golin"
+
+# Imports
+import os
+import tempfile
+import unittest
+from unittest import mock
+from classes.application import Application
+from classes.config import Config
+from classes.directory import Directory
+from utils.journal import MoveJournal
+from utils.logging import MoveLog
+
+# Constants
+FILES = 120
+BATCH_SIZE = 50
+
+
+# Classes
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.journal = MoveJournal(self.path("moves.jsonl"))
+        self.log = MoveLog(self.path("log.jsonl"))
+        self.patches = [
+            mock.patch("utils.journal.move_journal", self.journal),
+            mock.patch("classes.application.move_journal", self.journal),
+            mock.patch("utils.logging.move_log", self.log),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+        os.mkdir(self.path("watch"))
+        os.mkdir(self.path("reports"))
+        self.app = Application(Config(watch_dir=self.path("watch"), ignored_names=[], ignore_char="!"))
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.journal.close()
+        self.log.close()
+        Directory.reset()
+        self.directory.cleanup()
+
+    def path(self, *names: str) -> str:
+        return os.path.join(self.directory.name, *names)
+
+    def test_directory_sort_syncs_once_per_batch(self):
+        self.app.add_directory(self.path("reports"), ["report"])
+        for number in range(FILES):
+            open(self.path("watch", f"report {number}.txt"), "w").close()
+
+        syncs = []
+        with mock.patch("os.fsync", side_effect=syncs.append):
+            for workers in (1, 4):
+                with self.subTest(workers=workers):
+                    syncs.clear()
+                    self.app.sort_directory(self.path("watch"), workers=workers, batch_size=BATCH_SIZE)
+                    self.assertEqual(len(syncs), -(-FILES // BATCH_SIZE))
+
+                    # Sorted back into the watched directory for the next run
+                    for name in os.listdir(self.path("reports")):
+                        os.rename(self.path("reports", name), self.path("watch", name))
+
+    def test_undo_skips_moves_cancelled_after_the_time_range(self):
+        open(self.path("reports", "kept.txt"), "w").close()
+        open(self.path("reports", "moved.txt"), "w").close()
+
+        self.journal.record(
+            {"batch": "a", "old_path": self.path("watch", "kept.txt"), "new_path": self.path("reports", "kept.txt"),
+             "timestamp": 100.0, "cancelled": False},
+            {"batch": "a", "old_path": self.path("watch", "moved.txt"), "new_path": self.path("reports", "moved.txt"),
+             "timestamp": 100.0, "cancelled": False},
+            {"batch": "a", "old_path": self.path("watch", "kept.txt"), "new_path": self.path("reports", "kept.txt"),
+             "timestamp": 200.0, "cancelled": True},
+        )
+
+        self.assertEqual(self.app.undo(since=50.0, until=150.0), 1)
+        self.assertTrue(os.path.exists(self.path("reports", "kept.txt")))
+        self.assertTrue(os.path.exists(self.path("watch", "moved.txt")))
+
+
+if __name__ == "__main__":
+    unittest.main()
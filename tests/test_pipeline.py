@@ -0,0 +1,91 @@
+# Tests of when the sort pipeline considers a file settled
+__author__ = "Matteo Golin"
+
+# Imports
+import os
+import tempfile
+import threading
+import time
+import unittest
+from classes.pipeline import SortPipeline, FIRST_CHECK
+
+# Constants
+QUIET_WINDOW = 1.0
+
+
+# Classes
+class RecordingApp:
+
+    """Stands in for the application, recording when each file would have been sorted instead of moving it."""
+
+    def __init__(self):
+        self.sorted = []
+        self.lock = threading.Lock()
+
+    def sort_file(self, file_path: str) -> None:
+        with self.lock:
+            self.sorted.append((file_path, time.monotonic()))
+
+
+class TestSettling(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = RecordingApp()
+        self.pipeline = SortPipeline(self.app, quiet_window=QUIET_WINDOW, workers=2)
+        self.pipeline.start()
+
+    def tearDown(self):
+        self.pipeline.stop()
+        self.directory.cleanup()
+
+    def write_in_chunks(self, name: str, pauses: list[float]) -> tuple[str, float]:
+
+        """Appends a chunk after each pause, submitting an event per chunk. Returns the path and last write time."""
+
+        file_path = os.path.join(self.directory.name, name)
+        for pause in [0, *pauses]:
+            time.sleep(pause)
+            with open(file_path, "ab") as file:
+                file.write(b"x" * 1024)
+            self.pipeline.submit(file_path)
+
+        return file_path, time.monotonic()
+
+    def test_writer_pausing_longer_than_the_first_check_is_not_moved_mid_write(self):
+        for pause in (0.3, 0.6):
+            with self.subTest(pause=pause):
+                self.assertGreater(pause, FIRST_CHECK)
+                file_path, last_write = self.write_in_chunks(f"chunks {pause}.bin", [pause] * 3)
+                time.sleep(QUIET_WINDOW * 2)
+
+                times = [when for path, when in self.app.sorted if path == file_path]
+                self.assertEqual(len(times), 1)
+                self.assertGreaterEqual(times[0], last_write + QUIET_WINDOW * 0.9)
+
+    def test_finished_file_is_sorted_once_the_quiet_window_is_over(self):
+        file_path, last_write = self.write_in_chunks("done.txt", [])
+        time.sleep(QUIET_WINDOW * 2)
+
+        times = [when for path, when in self.app.sorted if path == file_path]
+        self.assertEqual(len(times), 1)
+        self.assertLess(times[0], last_write + QUIET_WINDOW + FIRST_CHECK)
+
+    def test_placeholder_is_held_while_the_download_is_written(self):
+        file_path = os.path.join(self.directory.name, "report.pdf")
+        open(file_path, "w").close()
+        with open(f"{file_path}.part", "w") as part:
+            part.write("partial")
+
+        self.pipeline.submit(file_path)
+        time.sleep(QUIET_WINDOW * 2)
+        self.assertEqual(self.app.sorted, [])
+
+        os.replace(f"{file_path}.part", file_path)
+        self.pipeline.submit(file_path)
+        time.sleep(QUIET_WINDOW * 2)
+        self.assertEqual([path for path, _ in self.app.sorted], [file_path])
+
+
+if __name__ == "__main__":
+    unittest.main()
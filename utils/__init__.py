@@ -2,8 +2,14 @@
 __author__ = "Matteo Golin"
 
 # Imports
+import os
+from itertools import islice
+from typing import Iterable, Iterator
 
 # Constants
+IN_PROGRESS_SUFFIXES = (".part", ".crdownload", ".tmp")  # Names browsers give downloads until they complete
+PLACEHOLDER_SUFFIXES = (".part", ".crdownload")  # Suffixes added to the final name of a download while it is written
+DEDUPE_MODES = ["off", "skip", "link", "discard"]  # What is done with an incoming file identical to one at its target
 
 
 # Functions
@@ -11,4 +17,43 @@ def filename(file_path: str) -> str:
 
     """Returns the filename separated from the file path."""
 
-    return file_path.split("\\")[-1]
+    return os.path.basename(file_path)
+
+
+def in_progress(file_path: str) -> bool:
+
+    """Returns True if the file is a download that is still being written, and will be renamed once complete."""
+
+    return file_path.lower().endswith(IN_PROGRESS_SUFFIXES)
+
+
+def snapshot(file_path: str) -> tuple[int, int] | None:
+
+    """Returns the size and modification time of a file, or None if it is not a file."""
+
+    try:
+        result = os.stat(file_path)
+    except OSError:
+        return None
+
+    return result.st_size, result.st_mtime_ns
+
+
+def placeholder(file_path: str) -> bool:
+
+    """
+    Returns True if the file is a placeholder for a download still being written next to it, such as the empty file
+    Firefox creates under the final name until it renames the .part file over it.
+    """
+
+    return any(os.path.exists(f"{file_path}{suffix}") for suffix in PLACEHOLDER_SUFFIXES)
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+
+    """Yields lists of up to size items from the iterable, without reading ahead more than one batch."""
+
+    iterator = iter(iterable)
+
+    while batch := list(islice(iterator, size)):
+        yield batch
@@ -0,0 +1,274 @@
+# Describes files by their content, reading only a bounded part of each file and caching the descriptions on disk
+__author__ = "Matteo Golin"
+
+# Imports
+import os
+import re
+import sqlite3
+import struct
+import threading
+
+# Constants
+CACHE_FILE = "classifier.sqlite"
+CACHE_VERSION = 1  # Increased whenever descriptions change, so that cached ones are discarded
+HEAD_BYTES = 64 * 1024  # Bytes read from the start of a file
+TAIL_BYTES = 16 * 1024  # Bytes read from the end of a PDF, where its document information usually is
+MAX_MEMBER_BYTES = 64 * 1024  # Largest Office metadata part that is read from an archive
+
+# File types recognized by their leading bytes, with the words they are described by
+SIGNATURES = [
+    (b"%PDF-", "pdf document"),
+    (b"\x89PNG\r\n\x1a\n", "png image"),
+    (b"\xff\xd8\xff", "jpg jpeg image photo"),
+    (b"GIF87a", "gif image"),
+    (b"GIF89a", "gif image"),
+    (b"II*\x00", "tif tiff image"),
+    (b"MM\x00*", "tif tiff image"),
+    (b"PK\x03\x04", "zip archive"),
+    (b"7z\xbc\xaf\x27\x1c", "7z archive"),
+    (b"Rar!\x1a\x07", "rar archive"),
+    (b"\x1f\x8b", "gz archive"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "office document"),
+    (b"ID3", "mp3 audio music"),
+    (b"fLaC", "flac audio music"),
+    (b"OggS", "ogg audio"),
+    (b"\x1aE\xdf\xa3", "mkv webm video"),
+    (b"MZ", "exe program"),
+]
+RIFF_TYPES = {b"WAVE": "wav audio", b"AVI ": "avi video", b"WEBP": "webp image"}
+ISO_BRANDS = {b"heic": "heic image photo", b"heix": "heic image photo", b"qt  ": "mov video"}  # Others are mp4
+OFFICE_TYPES = {"word/": "docx word document", "xl/": "xlsx excel spreadsheet", "ppt/": "pptx powerpoint presentation"}
+EXIF_TEXT_TAGS = {0x010E, 0x010F, 0x0110, 0x0132}  # Image description, camera make and model, date
+
+PDF_TITLE = re.compile(rb"/(?:Title|Subject|Keywords)\s*\(((?:\\.|[^\\)])*)\)")
+OFFICE_TEXT = re.compile(r"<(?:dc:title|dc:subject|cp:keywords)>([^<]*)<")
+
+
+# Class
+class Classifier:
+
+    """
+    Describes files with words taken from their content: their type from their leading bytes, the titles of PDF and
+    Office documents, and the camera and date of photos. No more than a bounded number of bytes is read from any file.
+    Descriptions are cached in a database keyed by the device, inode, size and modification time of the file, so a
+    file is only read again once it changed, even if it was renamed or moved on the same drive.
+    """
+
+    def __init__(self, filename: str = CACHE_FILE):
+        self.filename = filename
+        self.connection = None
+        self.lock = threading.Lock()
+
+    # Methods
+    def describe(self, file_path: str) -> str:
+
+        """Returns the words describing the content of the file, or an empty string if it cannot be read."""
+
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return ""
+
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+        with self.lock:
+            row = self.__database().execute(
+                "SELECT description FROM descriptions WHERE device = ? AND inode = ? AND size = ? AND mtime = ?", key
+            ).fetchone()
+        if row is not None:
+            return row[0]
+
+        try:
+            description = sniff(file_path, stat.st_size)
+        except OSError:
+            return ""  # Not cached, as the file may be readable once it is no longer in use
+
+        with self.lock:
+            database = self.__database()
+            database.execute("INSERT OR REPLACE INTO descriptions VALUES (?, ?, ?, ?, ?)", (*key, description))
+            database.commit()
+
+        return description
+
+    def close(self):
+
+        """Closes the cache. It is opened again on the next description."""
+
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def __database(self) -> sqlite3.Connection:
+
+        """Returns the cache connection, opening the cache and discarding it if it is outdated. Must hold the lock."""
+
+        if self.connection is None:
+            connection = sqlite3.connect(self.filename, check_same_thread=False)
+            connection.execute("PRAGMA synchronous = OFF")  # A lost description is only read again
+
+            if connection.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+                connection.execute("DROP TABLE IF EXISTS descriptions")
+                connection.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS descriptions ("
+                "device INTEGER, inode INTEGER, size INTEGER, mtime INTEGER, description TEXT, "
+                "PRIMARY KEY (device, inode, size, mtime))"
+            )
+            connection.commit()
+            self.connection = connection
+
+        return self.connection
+
+
+# Functions
+def sniff(file_path: str, size: int) -> str:
+
+    """Reads the bounded parts of the file needed to describe it, and returns the words describing it."""
+
+    with open(file_path, "rb") as file:
+        head = file.read(HEAD_BYTES)
+
+        words = [file_type(head)]
+
+        if head.startswith(b"%PDF-"):
+            tail = b""
+            if size > HEAD_BYTES:
+                file.seek(max(size - TAIL_BYTES, HEAD_BYTES))
+                tail = file.read(TAIL_BYTES)
+            words.extend(pdf_text(head + tail))
+
+        elif head.startswith(b"PK\x03\x04") and b"[Content_Types].xml" in head:
+            words.extend(office_text(file, head))
+
+        elif head.startswith(b"\xff\xd8\xff"):
+            words.extend(exif_text(head))
+
+    return " ".join(word for word in words if word)
+
+
+def file_type(head: bytes) -> str:
+
+    """Returns the words describing the type of file starting with the passed bytes."""
+
+    for signature, words in SIGNATURES:
+        if head.startswith(signature):
+            return words
+
+    if head[:4] == b"RIFF":
+        return RIFF_TYPES.get(head[8:12], "")
+
+    if head[4:8] == b"ftyp":
+        return ISO_BRANDS.get(head[8:12], "mp4 video")
+
+    return ""
+
+
+def pdf_text(data: bytes) -> list[str]:
+
+    """Returns the title, subject and keywords found in the document information of a PDF."""
+
+    texts = []
+
+    for match in PDF_TITLE.finditer(data):
+        text = match.group(1)
+        if text.startswith(b"\xfe\xff"):  # UTF-16 text strings are marked by a byte order mark
+            texts.append(text[2:].decode("utf-16-be", errors="ignore"))
+        else:
+            texts.append(text.decode("latin-1"))
+
+    return texts
+
+
+def office_text(file, head: bytes) -> list[str]:
+
+    """
+    Returns the kind of Office document an archive is, judged by the folders named in its first entries, along with
+    its title, subject and keywords.
+    """
+
+    import zipfile  # Only needed for Office documents, and slow to import
+
+    texts = [words for folder, words in OFFICE_TYPES.items() if folder.encode() in head]
+
+    try:
+        archive = zipfile.ZipFile(file)  # Only the directory at the end of the archive and the metadata part are read
+    except (zipfile.BadZipFile, ValueError):
+        return texts
+
+    with archive:
+        try:
+            info = archive.getinfo("docProps/core.xml")
+        except KeyError:
+            return texts
+
+        if info.file_size <= MAX_MEMBER_BYTES:
+            try:
+                core = archive.read(info).decode("utf-8", errors="ignore")
+            except (zipfile.BadZipFile, NotImplementedError, RuntimeError):  # Damaged, unsupported or encrypted
+                return texts
+            texts.extend(OFFICE_TEXT.findall(core))
+
+    return texts
+
+
+def exif_text(head: bytes) -> list[str]:
+
+    """Returns the camera make and model, image description and year found in the EXIF data of a JPEG."""
+
+    position = 2
+    while position + 4 <= len(head) and head[position] == 0xFF:
+        marker = head[position + 1]
+        length = struct.unpack(">H", head[position + 2:position + 4])[0]
+        segment = head[position + 4:position + 2 + length]
+
+        if marker == 0xE1 and segment.startswith(b"Exif\x00\x00"):
+            return tiff_text(segment[6:])
+        if marker == 0xDA:  # Image data starts, there is no EXIF data
+            break
+
+        position += 2 + length
+
+    return []
+
+
+def tiff_text(tiff: bytes) -> list[str]:
+
+    """Returns the text tags of the first image directory of TIFF formatted EXIF data."""
+
+    if tiff[:2] == b"II":
+        order = "<"
+    elif tiff[:2] == b"MM":
+        order = ">"
+    else:
+        return []
+
+    try:
+        offset = struct.unpack(f"{order}I", tiff[4:8])[0]
+        count = struct.unpack(f"{order}H", tiff[offset:offset + 2])[0]
+    except struct.error:
+        return []
+
+    texts = []
+    for number in range(count):
+        entry = tiff[offset + 2 + number * 12:offset + 14 + number * 12]
+        if len(entry) < 12:
+            break
+
+        tag, kind, length = struct.unpack(f"{order}HHI", entry[:8])
+        if tag not in EXIF_TEXT_TAGS or kind != 2:  # Only ASCII values
+            continue
+
+        if length <= 4:
+            value = entry[8:8 + length]
+        else:
+            start = struct.unpack(f"{order}I", entry[8:12])[0]
+            value = tiff[start:start + length]
+
+        text = value.split(b"\x00")[0].decode("ascii", errors="ignore").strip()
+        if tag == 0x0132:
+            text = text[:4]  # Only the year of dates like 2026:10:18 10:00:00
+        texts.append(text)
+
+    return texts
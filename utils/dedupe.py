@@ -0,0 +1,228 @@
+# Index of the files in target directories, used to find byte-identical copies without rehashing the archive
+__author__ = "Matteo Golin"
+
+# Imports
+import os
+import sqlite3
+import threading
+from typing import NamedTuple
+from .files import PARTIAL_BLOCK_SIZE, checksum, partial_checksum
+
+# Constants
+INDEX_FILE = "dedupe.sqlite"
+INDEX_VERSION = 1  # Increased whenever the layout changes, so that outdated indexes are discarded
+
+
+# Types
+class Digests(NamedTuple):
+    partial: str | None = None
+    full: str | None = None
+
+
+class Entry(NamedTuple):
+    path: str
+    size: int
+    mtime: int
+    partial: str | None
+    full: str | None
+
+
+# Class
+class DedupeIndex:
+
+    """
+    Persistent index of the files in target directories, by size. A file is compared with the files of the same size
+    at its destination by a checksum of its first and last blocks, and only files that also match on those are hashed
+    in full. Checksums are computed the first time they are needed and stored, so a file in the archive is hashed at
+    most once for as long as it is unchanged. Directories are listed again, without hashing, only when their
+    modification time shows that something other than the sorter changed them.
+    """
+
+    def __init__(self, filename: str = INDEX_FILE):
+        self.filename = filename
+        self.connection = None
+        self.lock = threading.Lock()
+
+    # Methods
+    def find(self, file_path: str, directory: str) -> tuple[str | None, Digests]:
+
+        """
+        Returns the path of a file in the directory identical to the passed file, or None, along with the checksums
+        of the passed file that had to be computed to find out.
+        """
+
+        size = os.stat(file_path).st_size
+        candidates = self.__candidates(directory, size)
+        if not candidates:
+            return None, Digests()
+
+        partial = partial_checksum(file_path)
+        small = size <= 2 * PARTIAL_BLOCK_SIZE  # The partial checksum of a small file covers all of it
+        full = partial if small else None
+
+        for candidate in candidates:
+            try:
+                if self.__digest(candidate, "partial", partial_checksum) != partial:
+                    continue
+                if small:
+                    return candidate.path, Digests(partial, full)
+
+                if full is None:
+                    full = checksum(file_path)
+                if self.__digest(candidate, "full", checksum) == full:
+                    return candidate.path, Digests(partial, full)
+
+            except OSError:  # Removed or made unreadable since it was listed
+                continue
+
+        return None, Digests(partial, full)
+
+    def add(self, path: str, directory: str, digests: Digests = Digests()):
+
+        """Indexes a file that was just nested into the directory, keeping any checksums already computed for it."""
+
+        stat = os.stat(path)
+
+        with self.lock:
+            database = self.__database()
+            database.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (path, directory, stat.st_size, stat.st_mtime_ns, digests.partial, digests.full),
+            )
+
+            # The directory changed because of this file, which is already accounted for
+            database.execute(
+                "UPDATE directories SET mtime = ? WHERE path = ?", (os.stat(directory).st_mtime_ns, directory)
+            )
+            database.commit()
+
+    def close(self):
+
+        """Closes the index. It is opened again on the next lookup."""
+
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def __candidates(self, directory: str, size: int) -> list[Entry]:
+
+        """
+        Returns the indexed files of the directory with the passed size, listing the directory again if it was changed
+        by something else, and dropping or resetting entries for files that were removed or modified since.
+        """
+
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return []
+
+        with self.lock:
+            database = self.__database()
+
+            row = database.execute("SELECT mtime FROM directories WHERE path = ?", (directory,)).fetchone()
+            if row is None or row[0] != mtime:
+                self.__list(directory, mtime)
+
+            entries = [
+                Entry(*row) for row in database.execute(
+                    "SELECT path, size, mtime, partial, full FROM files WHERE directory = ? AND size = ?",
+                    (directory, size),
+                )
+            ]
+
+            candidates = []
+            for entry in entries:
+                try:
+                    stat = os.stat(entry.path)
+                except OSError:
+                    database.execute("DELETE FROM files WHERE path = ?", (entry.path,))
+                    continue
+
+                if (stat.st_size, stat.st_mtime_ns) != (entry.size, entry.mtime):
+                    database.execute(
+                        "UPDATE files SET size = ?, mtime = ?, partial = NULL, full = NULL WHERE path = ?",
+                        (stat.st_size, stat.st_mtime_ns, entry.path),
+                    )
+                    if stat.st_size != size:
+                        continue
+                    entry = Entry(entry.path, stat.st_size, stat.st_mtime_ns, None, None)
+
+                candidates.append(entry)
+
+            database.commit()
+
+        return candidates
+
+    def __list(self, directory: str, mtime: int):
+
+        """
+        Brings the entries of a directory up to date with its files, keeping the checksums of unchanged files. Must be
+        called holding the lock.
+        """
+
+        database = self.__database()
+        indexed = {
+            path: (size, file_mtime)
+            for path, size, file_mtime in database.execute(
+                "SELECT path, size, mtime FROM files WHERE directory = ?", (directory,)
+            )
+        }
+
+        changed = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+
+                stat = entry.stat(follow_symlinks=False)
+                if indexed.pop(entry.path, None) != (stat.st_size, stat.st_mtime_ns):
+                    changed.append((entry.path, directory, stat.st_size, stat.st_mtime_ns, None, None))
+
+        database.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", changed)
+        database.executemany("DELETE FROM files WHERE path = ?", ((path,) for path in indexed))
+        database.execute("INSERT OR REPLACE INTO directories VALUES (?, ?)", (directory, mtime))
+
+    def __digest(self, entry: Entry, column: str, digest) -> str:
+
+        """Returns a stored checksum of an indexed file, computing and storing it if it was never needed before."""
+
+        value = entry.partial if column == "partial" else entry.full
+        if value is not None:
+            return value
+
+        value = digest(entry.path)
+
+        with self.lock:
+            database = self.__database()
+            database.execute(
+                f"UPDATE files SET {column} = ? WHERE path = ? AND size = ? AND mtime = ?",
+                (value, entry.path, entry.size, entry.mtime),
+            )
+            database.commit()
+
+        return value
+
+    def __database(self) -> sqlite3.Connection:
+
+        """Returns the index connection, opening the index and discarding it if it is outdated. Must hold the lock."""
+
+        if self.connection is None:
+            connection = sqlite3.connect(self.filename, check_same_thread=False)
+            connection.execute("PRAGMA synchronous = OFF")  # A lost entry is only listed or hashed again
+
+            if connection.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+                connection.execute("DROP TABLE IF EXISTS files")
+                connection.execute("DROP TABLE IF EXISTS directories")
+                connection.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, directory TEXT, size INTEGER, mtime INTEGER, partial TEXT, full TEXT)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS files_by_size ON files (directory, size)")
+            connection.execute("CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, mtime INTEGER)")
+            connection.commit()
+            self.connection = connection
+
+        return self.connection
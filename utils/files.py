@@ -0,0 +1,187 @@
+# File operations used when nesting files
+__author__ = "Matteo Golin"
+
+# Imports
+import errno
+import os
+import sys
+from typing import BinaryIO
+
+# Constants
+LINK_UNSUPPORTED = {errno.EPERM, errno.EACCES, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EMLINK}
+KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EBADF}
+ERROR_NOT_SAME_DEVICE = 17  # Windows error raised when renaming across drives
+COPY_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes copied at a time when the kernel cannot copy the file by itself
+SENDFILE_CHUNK_SIZE = 1024 * 1024 * 1024  # Bytes passed to each sendfile call, which copies at most ~2 GB at a time
+PARTIAL_BLOCK_SIZE = 64 * 1024  # Bytes hashed from each end of a file for a partial checksum
+
+
+# Functions
+def rename_no_clobber(source: str, destination: str):
+
+    """
+    Renames a file, raising FileExistsError instead of replacing the destination if it already exists. On Windows,
+    os.rename never replaces files. Elsewhere, the file is hard linked to its new name, which fails atomically if the
+    name is taken, and the old name is then removed.
+    """
+
+    if os.name == "nt":
+        os.rename(source, destination)
+        return
+
+    try:
+        os.link(source, destination, follow_symlinks=False)
+
+    except OSError as error:
+        if error.errno not in LINK_UNSUPPORTED:
+            raise
+
+        # File systems without hard links can only check the destination before renaming
+        if os.path.lexists(destination):
+            raise FileExistsError(errno.EEXIST, "File exists", destination)
+        os.rename(source, destination)
+
+    else:
+        os.unlink(source)
+
+
+def move_file(source: str, destination: str, verify: bool = False):
+
+    """
+    Moves a file without replacing the destination. Files moved to another file system are copied, optionally
+    verified, and only then removed from their original location.
+    """
+
+    try:
+        rename_no_clobber(source, destination)
+    except OSError as error:
+        if error.errno != errno.EXDEV and getattr(error, "winerror", None) != ERROR_NOT_SAME_DEVICE:
+            raise
+
+        copy_file(source, destination, verify)
+        os.unlink(source)
+
+
+def link_file(existing: str, destination: str, source: str, verify: bool = False):
+
+    """
+    Moves a file to the destination as a hard link to an identical existing file, so that both share their storage.
+    Raises FileExistsError if the destination is taken. If the existing file cannot be linked, such as on another
+    file system, the source is moved instead.
+    """
+
+    try:
+        os.link(existing, destination, follow_symlinks=False)
+    except FileExistsError:
+        raise
+    except OSError:
+        move_file(source, destination, verify)
+    else:
+        os.unlink(source)
+
+
+def copy_file(source: str, destination: str, verify: bool = False):
+
+    """
+    Copies a file and its metadata to a destination that must not exist yet. The data is copied by the kernel where
+    the platform allows it, so it never passes through Python buffers, and by large chunks otherwise. If verify is
+    True, the checksums of both files are compared afterwards. A partial copy is removed if anything fails.
+    """
+
+    with open(source, "rb") as source_file:
+        destination_file = open(destination, "xb")
+
+        try:
+            with destination_file:
+                size = os.fstat(source_file.fileno()).st_size
+                _copy_data(source_file, destination_file, size)
+
+            import shutil  # Only imported once a file is copied, as the command line subcommands never copy
+
+            shutil.copystat(source, destination)
+
+            if verify and checksum(source) != checksum(destination):
+                raise OSError(errno.EIO, "Copied file does not match the original", destination)
+
+        except BaseException:
+            os.remove(destination)
+            raise
+
+
+def _copy_data(source: BinaryIO, destination: BinaryIO, size: int):
+
+    """Copies size bytes between two open files, using the fastest method available."""
+
+    source_fd, destination_fd = source.fileno(), destination.fileno()
+    copied = 0
+
+    # Copied within the kernel, possibly without reading the data at all on file systems that support it
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < size:
+                sent = os.copy_file_range(source_fd, destination_fd, size - copied, copied, copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as error:
+            if error.errno not in KERNEL_COPY_UNSUPPORTED:
+                raise
+
+    # Copied within the kernel through the page cache
+    if copied < size and hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+        try:
+            os.lseek(destination_fd, copied, os.SEEK_SET)
+            while copied < size:
+                sent = os.sendfile(destination_fd, source_fd, copied, min(size - copied, SENDFILE_CHUNK_SIZE))
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as error:
+            if error.errno not in KERNEL_COPY_UNSUPPORTED:
+                raise
+
+    # Copied in large chunks through a single reused buffer
+    if copied < size:
+        source.seek(copied)
+        destination.seek(copied)
+        buffer = bytearray(COPY_CHUNK_SIZE)
+        view = memoryview(buffer)
+
+        while read := source.readinto(buffer):
+            destination.write(view[:read])
+
+
+def checksum(file_path: str) -> str:
+
+    """Returns the BLAKE2 checksum of a file, read in chunks through a single reused buffer."""
+
+    import hashlib  # Only imported once a file is hashed, as the command line subcommands never hash
+
+    digest = hashlib.blake2b()
+    buffer = bytearray(COPY_CHUNK_SIZE)
+    view = memoryview(buffer)
+
+    with open(file_path, "rb") as file:
+        while read := file.readinto(buffer):
+            digest.update(view[:read])
+
+    return digest.hexdigest()
+
+
+def partial_checksum(file_path: str) -> str:
+
+    """Returns the BLAKE2 checksum of the first and last blocks of a file, which are all of it for small files."""
+
+    import hashlib  # Only imported once a file is hashed, as the command line subcommands never hash
+
+    digest = hashlib.blake2b()
+
+    with open(file_path, "rb") as file:
+        digest.update(file.read(PARTIAL_BLOCK_SIZE))
+
+        size = os.fstat(file.fileno()).st_size
+        if size > PARTIAL_BLOCK_SIZE:
+            file.seek(max(size - PARTIAL_BLOCK_SIZE, PARTIAL_BLOCK_SIZE))
+            digest.update(file.read(PARTIAL_BLOCK_SIZE))
+
+    return digest.hexdigest()
@@ -0,0 +1,168 @@
+# Durable record of every file move, written before the move happens so that moves can be undone
+__author__ = "Matteo Golin"
+
+# Imports
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Iterator
+from .logging import rotate
+
+# Constants
+JOURNAL_FILE = "moves.jsonl"
+MAX_JOURNAL_SIZE = 10 * 1024 * 1024  # Bytes the journal can reach before it is rotated
+BACKUP_COUNT = 5  # Number of rotated journals that are kept
+
+
+# Class
+class MoveJournal:
+
+    """
+    Records file moves as JSON lines before they happen, returning only once the record is on disk. Records written
+    while another thread is syncing the journal are made durable together by the next sync, so threads moving files at
+    the same time share one fsync instead of paying for one each.
+    """
+
+    def __init__(
+            self,
+            filename: str = JOURNAL_FILE,
+            max_size: int = MAX_JOURNAL_SIZE,
+            backup_count: int = BACKUP_COUNT,
+    ):
+        self.filename = filename
+        self.max_size = max_size
+        self.backup_count = backup_count
+
+        self.file = None
+        self.written = 0  # Number of records written to the file
+        self.synced = 0  # Number of records known to be on disk
+        self.syncing = False
+        self.condition = threading.Condition()
+
+    # Methods
+    def record(self, *records: dict):
+
+        """Writes the records and waits until they are on disk, syncing them along with any other waiting records."""
+
+        if not records:
+            return
+
+        lines = "".join(f"{json.dumps(record)}\n" for record in records)
+
+        with self.condition:
+            if self.file is not None and self.__idle() and self.file.tell() >= self.max_size:
+                self.__rotate()
+            if self.file is None:
+                self.file = open(self.filename, "a")
+
+            self.file.write(lines)
+            self.written += 1
+            position = self.written
+
+            while self.synced < position:
+                if self.syncing:  # Another thread is syncing, this record will be part of the next group
+                    self.condition.wait()
+                    continue
+
+                # Become the thread that syncs every record written so far
+                self.syncing = True
+                target = self.written
+                self.file.flush()
+                descriptor = self.file.fileno()
+
+                self.condition.release()
+                try:
+                    os.fsync(descriptor)
+                finally:
+                    self.condition.acquire()
+                    self.syncing = False
+                    self.condition.notify_all()  # If the sync failed, a waiting thread retries it
+
+                self.synced = max(self.synced, target)
+
+    def close(self):
+
+        """Closes the journal file. It is opened again if more records are written."""
+
+        with self.condition:
+            while not self.__idle():
+                self.condition.wait()
+
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def read(self) -> Iterator[dict]:
+
+        """Yields every record, oldest first, including those in rotated journals. Unreadable lines are skipped."""
+
+        filenames = [f"{self.filename}.{number}" for number in range(self.backup_count, 0, -1)] + [self.filename]
+
+        for filename in filenames:
+            try:
+                journal = open(filename)
+            except FileNotFoundError:
+                continue
+
+            with journal:
+                for line in journal:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:  # A record torn by a crash
+                        continue
+
+    def __idle(self) -> bool:
+
+        """Returns True if every record written is on disk. Must be called holding the condition."""
+
+        return not self.syncing and self.synced == self.written
+
+    def __rotate(self):
+
+        """Closes the journal and rotates it, once every record written to it is on disk."""
+
+        self.file.close()
+        self.file = None
+        rotate(self.filename, self.backup_count)
+
+
+# Journal shared by the whole application, closed when the interpreter exits
+move_journal = MoveJournal()
+atexit.register(move_journal.close)
+
+
+# Functions
+def new_batch() -> str:
+
+    """Returns a new batch name, made of the current time and a random suffix so that it is unique."""
+
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(2).hex()}"
+
+
+def journal_file_movement(old_path: str, new_path: str, batch: str | None = None, cancelled: bool = False):
+
+    """
+    Durably records that a file is about to be moved, as part of the passed batch. If the move then fails, it is
+    recorded again as cancelled, so that undoing the batch leaves whatever is at the new path alone.
+    """
+
+    journal_file_movements([(old_path, new_path)], batch, cancelled)
+
+
+def journal_file_movements(moves: list[tuple[str, str]], batch: str | None = None, cancelled: bool = False):
+
+    """Durably records several (old path, new path) moves at once, with a single sync."""
+
+    timestamp = time.time()
+    move_journal.record(*(
+        {
+            "batch": batch,
+            "old_path": old_path,
+            "new_path": new_path,
+            "timestamp": timestamp,
+            "cancelled": cancelled,
+        }
+        for old_path, new_path in moves
+    ))
@@ -2,26 +2,147 @@
 __author__ = "Matteo Golin"
 
 # Imports
+import atexit
+import json
+import os
+import queue
+import threading
+import time
 
 # Constants
-LOG_FILE = "log.txt"
+LOG_FILE = "log.jsonl"
+FLUSH_INTERVAL = 1.0  # Seconds between writes of the queued records
+MAX_LOG_SIZE = 10 * 1024 * 1024  # Bytes the log can reach before it is rotated
+BACKUP_COUNT = 5  # Number of rotated logs that are kept
+
+
+# Class
+class MoveLog:
+
+    """
+    Records file movements as JSON lines. Records are queued by the sorting threads and written in batches by a
+    background thread, which flushes on an interval or when the log is closed, and rotates the file by size.
+    """
+
+    def __init__(
+            self,
+            filename: str = LOG_FILE,
+            flush_interval: float = FLUSH_INTERVAL,
+            max_size: int = MAX_LOG_SIZE,
+            backup_count: int = BACKUP_COUNT,
+    ):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.backup_count = backup_count
+
+        self.records = queue.SimpleQueue()
+        self.wake = threading.Event()
+        self.closed = False
+        self.lock = threading.Lock()
+        self.writer = None
+
+    # Methods
+    def record(self, record: dict):
+
+        """Queues a record to be written, starting the writer on first use."""
+
+        if self.writer is None:
+            with self.lock:
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self.__run, name="move-log", daemon=True)
+                    self.writer.start()
+
+        self.records.put(record)
+
+    def close(self):
+
+        """Writes all queued records and stops the writer. A new writer is started if more records are queued."""
+
+        with self.lock:
+            if self.writer is None:
+                return
+
+            self.closed = True
+            self.wake.set()
+            self.writer.join()
+
+            self.writer = None
+            self.closed = False
+            self.wake.clear()
+
+    def __run(self):
+
+        """Writes the queued records every flush interval until the log is closed."""
+
+        while not self.closed:
+            self.wake.wait(self.flush_interval)
+            self.__write_batch()
+
+        self.__write_batch()
+
+    def __write_batch(self):
+
+        """Writes every queued record in a single write and prints them to the console."""
+
+        batch = []
+        while True:
+            try:
+                batch.append(self.records.get_nowait())
+            except queue.Empty:
+                break
+
+        if not batch:
+            return
+
+        with open(self.filename, "a") as log:
+            log.write("".join(f"{json.dumps(record)}\n" for record in batch))
+            size = log.tell()
+
+        for record in batch:
+            print(f"{os.path.basename(record['new_path'])} was moved from {os.path.dirname(record['old_path'])} to "
+                  f"{os.path.dirname(record['new_path'])}")
+
+        if size >= self.max_size:
+            rotate(self.filename, self.backup_count)
+
+
+# Log shared by the whole application, flushed when the interpreter exits
+move_log = MoveLog()
+atexit.register(move_log.close)
 
 
 # Functions
-def write_to_log(info: str):
+def rotate(filename: str, backup_count: int):
 
-    """Writes information to the logging file."""
+    """Renames a file to file.1, file.1 to file.2 and so on, discarding the oldest backup."""
 
-    with open(LOG_FILE, "a") as log:
-        log.write(f"{info}\n")
+    for number in range(backup_count - 1, 0, -1):
+        backup = f"{filename}.{number}"
+        if os.path.exists(backup):
+            os.replace(backup, f"{filename}.{number + 1}")
 
+    if backup_count > 0:
+        os.replace(filename, f"{filename}.1")
+    else:
+        os.remove(filename)
 
-def log_file_movement(old_path: str, new_path: str):
 
-    """Logs the movement of a file."""
+def log_file_movement(
+        old_path: str,
+        new_path: str,
+        directory: str | None = None,
+        score: int | None = None,
+        duration: float | None = None,
+):
 
-    file_name = old_path.split("\\")[-1]
+    """Logs the movement of a file."""
 
-    info = f"{file_name} was moved from {old_path.replace(file_name, '')} to {new_path.replace(file_name, '')}"
-    print(info)
-    write_to_log(info)
+    move_log.record({
+        "old_path": old_path,
+        "new_path": new_path,
+        "directory": directory,
+        "score": score,
+        "timestamp": time.time(),
+        "duration": duration,
+    })
@@ -0,0 +1,243 @@
+# Counters and histograms describing what the running sorter is doing, exported in the Prometheus text format
+__author__ = "Matteo Golin"
+
+# Imports
+import bisect
+import os
+import threading
+
+# Constants
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+WRITE_INTERVAL = 15.0  # Seconds between writes of the metrics file
+
+
+# Classes
+class Counter:
+
+    """A value that only goes up."""
+
+    def __init__(self, name: str, description: str, labels: dict | None = None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+
+        """Increases the counter."""
+
+        with self.lock:
+            self.value += amount
+
+    def render(self) -> list[str]:
+
+        """Returns the Prometheus sample lines of the counter."""
+
+        return [f"{self.name}{format_labels(self.labels)} {self.value}"]
+
+
+class Histogram:
+
+    """Counts observed values in cumulative buckets, along with their sum and count."""
+
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...], labels: dict | None = None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last count is for values above the largest bucket
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+
+        """Records a value."""
+
+        position = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            self.counts[position] += 1
+            self.sum += value
+
+    def render(self) -> list[str]:
+
+        """Returns the Prometheus sample lines of the histogram."""
+
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = format_labels({**self.labels, "le": "+Inf" if bound == float("inf") else repr(bound)})
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+        lines.append(f"{self.name}_sum{format_labels(self.labels)} {total}")
+        lines.append(f"{self.name}_count{format_labels(self.labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+
+    """Holds all metrics so they can be rendered together."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, description: str, labels: dict | None = None) -> Counter:
+
+        """Creates and registers a counter."""
+
+        counter = Counter(name, description, labels)
+        self.metrics.append(counter)
+        return counter
+
+    def histogram(self, name: str, description: str, buckets: tuple[float, ...], labels: dict | None = None):
+
+        """Creates and registers a histogram."""
+
+        histogram = Histogram(name, description, buckets, labels)
+        self.metrics.append(histogram)
+        return histogram
+
+    def render(self) -> str:
+
+        """Returns all metrics in the Prometheus text exposition format."""
+
+        lines = []
+        described = set()
+
+        for metric in self.metrics:
+            if metric.name not in described:  # Metrics that only differ by labels share their description
+                described.add(metric.name)
+                kind = "counter" if isinstance(metric, Counter) else "histogram"
+                lines.append(f"# HELP {metric.name} {metric.description}")
+                lines.append(f"# TYPE {metric.name} {kind}")
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+class Exporter:
+
+    """Exposes the metrics by periodically writing them to a file and/or serving them over HTTP on localhost."""
+
+    def __init__(self, registry: Registry, file_path: str | None = None, port: int | None = None):
+        self.registry = registry
+        self.file_path = file_path
+        self.port = port
+
+        self.stopped = threading.Event()
+        self.writer = None
+        self.server = None
+
+    def start(self):
+
+        """Starts writing the metrics file and serving HTTP requests, for whichever of them were configured."""
+
+        if self.file_path:
+            self.writer = threading.Thread(target=self.__write_periodically, name="metrics-writer", daemon=True)
+            self.writer.start()
+
+        if self.port:
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Slow to import, rarely needed
+
+            registry = self.registry
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+
+                def do_GET(self):
+                    body = registry.render().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass  # Requests are not worth printing to the console
+
+            self.server = ThreadingHTTPServer(("127.0.0.1", self.port), MetricsHandler)
+            threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True).start()
+
+    def stop(self):
+
+        """Stops serving metrics, writing the file one last time."""
+
+        self.stopped.set()
+
+        if self.writer is not None:
+            self.writer.join()
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def write(self):
+
+        """Atomically replaces the metrics file, so that collectors never read a partial file."""
+
+        temporary = f"{self.file_path}.tmp"
+        with open(temporary, "w") as file:
+            file.write(self.registry.render())
+        os.replace(temporary, self.file_path)
+
+    def __write_periodically(self):
+
+        """Writes the metrics file every interval until stopped."""
+
+        while not self.stopped.wait(WRITE_INTERVAL):
+            self.write()
+
+        self.write()
+
+
+# Functions
+def format_labels(labels: dict) -> str:
+
+    """Returns labels in the Prometheus format, or nothing if there are none."""
+
+    if not labels:
+        return ""
+
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels.items())
+    return f"{{{pairs}}}"
+
+
+# Metrics of the sorter
+registry = Registry()
+
+events_received = registry.counter("pyorganize_events_received_total", "File system events received.")
+events_coalesced = registry.counter(
+    "pyorganize_events_coalesced_total", "Events merged into an event already waiting for the same path."
+)
+events_dropped = registry.counter(
+    "pyorganize_events_dropped_total", "Events dropped because too many files were waiting, replaced by a rescan."
+)
+overflows = registry.counter("pyorganize_overflows_total", "Rescans of the watched directory after an event storm.")
+files_moved = registry.counter("pyorganize_files_moved_total", "Files nested into a directory.")
+files_ignored = registry.counter("pyorganize_files_ignored_total", "Files skipped because of the ignore character.")
+files_unmatched = registry.counter("pyorganize_files_unmatched_total", "Files left in place with no matching tags.")
+route_cache_hits = registry.counter(
+    "pyorganize_route_cache_hits_total", "Files routed using a remembered decision for the same set of tags."
+)
+route_cache_misses = registry.counter(
+    "pyorganize_route_cache_misses_total", "Files routed by scoring the directories that own their tags."
+)
+duplicates = registry.counter(
+    "pyorganize_duplicates_total", "Files identical to a file already in the directory they were sorted into."
+)
+errors = registry.counter("pyorganize_errors_total", "Files that could not be sorted because of an error.")
+
+event_latency = registry.histogram(
+    "pyorganize_event_to_move_seconds", "Time from the first event for a file until it was moved.", LATENCY_BUCKETS
+)
+classify_seconds, match_seconds, rename_seconds, log_seconds = (
+    registry.histogram("pyorganize_stage_seconds", "Time spent in each stage of sorting a file.", STAGE_BUCKETS,
+                       {"stage": stage})
+    for stage in ("classify", "match", "rename", "log")
+)
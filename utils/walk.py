@@ -0,0 +1,80 @@
+# Directory tree walking that skips ignored directories and scans wide trees in parallel
+__author__ = "Matteo Golin"
+
+# Imports
+import os
+import queue
+import threading
+from typing import Iterable, Iterator
+
+# Constants
+WORKERS = 8  # Directories scanned at the same time
+RESULT_BUFFER = 1024  # Paths found ahead of the consumer before the scanners wait for it
+DONE = None
+
+
+# Functions
+def walk_directories(root: str, ignored_names: Iterable[str] = (), workers: int = WORKERS) -> Iterator[str]:
+
+    """
+    Streams the path of root and of every directory below it. Directories whose name is ignored are never entered,
+    nor are symbolic links. Each directory is scanned with os.scandir on a pool of threads, so the subdirectories of
+    a wide tree are scanned in parallel, and paths are yielded as soon as they are found, in no particular order.
+    """
+
+    from concurrent.futures import ThreadPoolExecutor  # Only imported when a tree is walked, as it is slow to import
+
+    ignored_names = set(ignored_names)
+    results = queue.Queue(maxsize=RESULT_BUFFER)
+    stopped = threading.Event()
+    outstanding = 1  # Directories submitted for scanning but not yet scanned
+    lock = threading.Lock()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def scan(path: str):
+        nonlocal outstanding
+
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if stopped.is_set():
+                        break
+
+                    try:
+                        is_directory = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+
+                    if is_directory and entry.name not in ignored_names:
+                        with lock:
+                            outstanding += 1
+                        put(entry.path)
+                        executor.submit(scan, entry.path)
+
+        except OSError:  # The directory was removed or cannot be read, so it is skipped like os.walk does
+            pass
+
+        finally:
+            with lock:
+                outstanding -= 1
+                finished = outstanding == 0
+            if finished:
+                put(DONE)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="walker") as executor:
+        try:
+            yield root
+            executor.submit(scan, root)
+
+            while (path := results.get()) is not DONE:
+                yield path
+
+        finally:
+            stopped.set()  # Lets the scanners finish early if the consumer stopped before the walk was complete